@@ -0,0 +1,300 @@
+# scripts/bench.py
+"""Benchmark do pdf27 com corpus sintético (gerado aqui, sem rede e sem dependências extras).
+
+    python scripts/bench.py [--files 200] [--master-rows 1000000] [--workers 4] [--out bench.json]
+    python scripts/bench.py --out novo.json --compare antigo.json
+
+Gera PDFs de ofertas parecidos com os do crawler (inclusive as variantes de erro de
+FIRST_PAGE_ERROR_RULES / PAGE_ERROR_PATTERNS e páginas após "complemente sua viagem")
+e uma base-mãe sintética, roda cada estágio do pdf27 num diretório temporário e
+imprime um JSON com tempo, arquivos/s, linhas/s e pico de RSS por estágio.
+O pico de RSS é o máximo do processo até o fim do estágio (ru_maxrss não desce).
+"""
+import os, sys, json, time, random, shutil, hashlib, argparse, platform, resource, tempfile, subprocess
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+
+# ── PDF mínimo (Helvetica/WinAnsi, uma linha de texto por Tj) ─────────────────
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def pdf_bytes(pages: list) -> bytes:
+    """PDF válido com uma página por lista de linhas."""
+    n = len(pages)
+    kids = [4 + 2 * i for i in range(n)]
+    objs = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        2: f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {n} >>".encode(),
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    }
+    for k, lines in zip(kids, pages):
+        ops = ["BT /F1 10 Tf 14 TL 40 800 Td"] + [f"({_pdf_escape(l)}) Tj T*" for l in lines] + ["ET"]
+        data = "\n".join(ops).encode("cp1252", errors="replace")
+        objs[k] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                   f"/Resources << /Font << /F1 3 0 R >> >> /Contents {k + 1} 0 R >>").encode()
+        objs[k + 1] = b"<< /Length %d >>\nstream\n" % len(data) + data + b"\nendstream"
+    out, offsets = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"), []
+    for i in range(1, len(objs) + 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + objs[i] + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objs) + 1, xref)
+    return bytes(out)
+
+# ── Corpus sintético ──────────────────────────────────────────────────────────
+LINES_PER_PAGE = 55
+AGENCIES = ["Decolar", "MaxMilhas", "123milhas", "Kiwi.com", "Trip.com", "Gol", "LATAM", "Azul",
+            "Gotogate", "Mytrip", "ViajaNet", "Zupper", "Submarino Viagens", "Skyscanner"]
+AIRLINES = ["LATAM", "GOL", "Azul", "TAP", "Air France", "Iberia"]
+ROUTES = ["GRU_SSA", "GRU_REC", "CGH_SDU", "BSB_GRU", "GIG_FOR", "POA_GRU", "CNF_GRU", "VCP_REC"]
+MONTHS = ["jan", "fev", "mar", "abr", "mai", "jun", "jul", "ago", "set", "out", "nov", "dez"]
+
+# texto de primeira página -> código esperado (espelha as regras do pdf27)
+ERROR_PAGES = {
+    "As melhores ofertas e promoções de passagens":      "ERRO DE PAGINA",
+    "Destinos nacionais mais buscados":                  "ERRO DE PAGINA",
+    "Encaminhando para o website solicitado...":         "ERRO DE PAGINA",
+    "Passagens aéreas em promoção | LATAM":              "ERRO DE PAGINA",
+    "Skyscanner Você é uma pessoa ou um robô?":          "ERRO ANTIBOT",
+    "Passagens aéreas, hotéis e aluguel de carros":      "ErroPaginaInicial",
+    "Pacotes de viagens com desconto":                   "ErroPaginaDecolar",
+}
+
+def _paginate(lines: list) -> list:
+    return [lines[i:i + LINES_PER_PAGE] for i in range(0, len(lines), LINES_PER_PAGE)] or [[]]
+
+def offer_doc(r: random.Random, search: datetime, n_offers: int, trailing_pages: int) -> list:
+    flight = search + timedelta(days=r.randint(1, 120))
+    dep = r.randint(5 * 60, 22 * 60)
+    arr = dep + r.randint(60, 300)
+    tipo = r.choice(["Direto", "1 escala", "2 escalas", "1 parada"])
+    lines = [
+        f"{search:%d/%m/%Y, %H:%M} https://www.google.com/travel/flights",
+        f"Ida - qua., {flight.day} de {MONTHS[flight.month - 1]}. de {flight.year}",
+        f"{dep // 60:02d}:{dep % 60:02d} - {arr // 60 % 24:02d}:{arr % 60:02d} {tipo} {r.choice(AIRLINES)}",
+        "Verificando preços e disponibilidade",
+    ]
+    for _ in range(n_offers):
+        lines.append(f"Reservar com {r.choice(AGENCIES)}")
+        lines.append(f"R$ {r.randint(250, 4500):,}".replace(",", ".") + f",{r.randint(0, 99):02d}")
+    lines.append("Complemente sua viagem")
+    for _ in range(trailing_pages * LINES_PER_PAGE):
+        lines.append(f"Hotel {r.choice(AGENCIES)} diária a partir de R$ {r.randint(90, 900)},00")
+    return _paginate(lines)
+
+def error_doc(r: random.Random, search: datetime, header: str) -> list:
+    lines = [header, f"{search:%d/%m/%Y, %H:%M} https://www.google.com/travel/flights"]
+    lines += [f"Conteúdo promocional {i} R$ {r.randint(90, 900)},00" for i in range(r.randint(5, 40))]
+    return _paginate(lines)
+
+def generate_corpus(directory: str, n_files: int, offers: int, trailing_pages: int,
+                    error_share: float, seed: int) -> dict:
+    """Grava os PDFs e devolve {nome: código de erro esperado ou None}."""
+    os.makedirs(directory, exist_ok=True)
+    r = random.Random(seed)
+    headers = list(ERROR_PAGES)
+    base = datetime(2025, 1, 1, 8, 0)
+    expected = {}
+    for i in range(n_files):
+        search = base + timedelta(days=r.randint(0, 180), minutes=r.randint(0, 600))
+        name = f"{r.choice(ROUTES)}_{i:06d}.pdf"
+        if r.random() < error_share:
+            header = headers[i % len(headers)]
+            pages, expected[name] = error_doc(r, search, header), ERROR_PAGES[header]
+        else:
+            pages, expected[name] = offer_doc(r, search, offers, trailing_pages), None
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(pdf_bytes(pages))
+    return expected
+
+def generate_master(path: str, n_rows: int, seed: int, rows_per_file: int = 12):
+    """Base-mãe sintética com o layout de colunas da real (inclusive ROW_ID_COL)."""
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rng = np.random.default_rng(seed)
+    n_files = max(1, n_rows // rows_per_file)
+    file_idx = np.sort(rng.integers(0, n_files, n_rows))
+
+    def pick(values, idx=None):
+        idx = rng.integers(0, len(values), n_rows) if idx is None else idx
+        return pa.array(values).take(pa.array(idx))
+
+    route_of_file = rng.integers(0, len(ROUTES), n_files)
+    names = [f"{ROUTES[route_of_file[i]]}_{i:07d}.PDF".upper() for i in range(n_files)]
+    trechos = [ROUTES[route_of_file[i]].replace("_", "-")[:6] for i in range(n_files)]
+    search = np.datetime64("2024-01-01") + rng.integers(0, 540, n_files).astype("timedelta64[D]")
+    advp = rng.integers(1, 120, n_files)
+    times = [f"{h:02d}:{m:02d}" for h in range(24) for m in range(0, 60, 5)]
+    prices = np.round(rng.uniform(250, 4500, n_rows), 2)
+    ids = [hashlib.sha1(b"%d" % i).hexdigest() for i in range(n_rows)]
+    table = pa.table({
+        "ADVP": pa.array(advp[file_idx]),
+        "Agência/Companhia": pick([a.upper() for a in AGENCIES[:-1]]),
+        "Companhia Aérea": pick([a.upper() for a in AIRLINES]),
+        "Data do Voo": pa.array(search[file_idx] + advp[file_idx].astype("timedelta64[D]")).cast(pa.timestamp("ns")),
+        "Data/Hora da Busca": pa.array(search[file_idx]).cast(pa.timestamp("ns")),
+        "Horário1": pick(times), "Horário2": pick(times), "Horário3": pick(times),
+        "ID Oferta": pa.array(ids),
+        "Nome do Arquivo": pick(names, file_idx),
+        "Preço": pa.array(prices),
+        "Ranking": pa.array(rng.integers(1, rows_per_file + 1, n_rows)),
+        "TRECHO": pick(trechos, file_idx),
+        "Tipo de Voo": pick(["DIRETO", "1 ESCALAS", "2 ESCALAS", "1 PARADAS"]),
+    })
+    from pdf27 import _typed_table, PARQUET_COMPRESSION
+    pq.write_table(_typed_table(table), path, compression=PARQUET_COMPRESSION)
+    return table.num_rows
+
+# ── Medição ───────────────────────────────────────────────────────────────────
+def _rss_mb(who=resource.RUSAGE_SELF) -> float:
+    kb = resource.getrusage(who).ru_maxrss
+    return round(kb / 1024 / (1024 if sys.platform == "darwin" else 1), 1)   # macOS reporta bytes
+
+class Bench:
+    def __init__(self):
+        self.stages = {}
+
+    def stage(self, name: str, fn, files: int = 0, rows_of=None):
+        print(f"[bench] {name}...", file=sys.stderr, flush=True)
+        t0 = time.perf_counter()
+        with redirect_stdout(sys.stderr):
+            result = fn()
+        sec = time.perf_counter() - t0
+        rows = rows_of(result) if rows_of else 0
+        rec = {"sec": round(sec, 4), "files": files, "rows": rows,
+               "rss_peak_mb": _rss_mb(), "rss_children_peak_mb": _rss_mb(resource.RUSAGE_CHILDREN)}
+        if files: rec["files_per_sec"] = round(files / sec, 2) if sec else None
+        if rows:  rec["rows_per_sec"] = round(rows / sec, 1) if sec else None
+        self.stages[name] = rec
+        return result
+
+def _git_rev() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+def run(args) -> dict:
+    workdir = args.workdir or tempfile.mkdtemp(prefix="pdf27-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)                       # o pdf27 usa caminhos relativos (inbox/, out/)
+    os.environ["PDF27_TEXT_CACHE"] = os.path.join(workdir, ".cache", "text")
+    os.environ["OFERTAS_INDEX"] = os.path.join(workdir, "out", "OFERTAS_INDEX.sqlite")
+    os.makedirs("out", exist_ok=True)
+
+    import pandas as pd
+    import pyarrow as pa
+    import pdfplumber
+    import pdf27
+    from text_cache import TextCache
+
+    b = Bench()
+    expected = b.stage("gen_corpus", lambda: generate_corpus(
+        pdf27.PDF_DIR, args.files, args.offers, args.trailing_pages, args.error_share, args.seed),
+        files=args.files)
+    paths = sorted(os.path.join(pdf27.PDF_DIR, n) for n in expected)
+    rows_of = lambda results: sum(len(of) for of, _ in results)
+
+    def serial():
+        return [pdf27.process_pdf(p) for p in paths]
+
+    pdf27.TEXT_CACHE = None
+    results = b.stage("extract_nocache", serial, files=len(paths), rows_of=rows_of)
+    pdf27.TEXT_CACHE = TextCache(os.environ["PDF27_TEXT_CACHE"])
+    b.stage("extract_cache_fill", serial, files=len(paths), rows_of=rows_of)
+    b.stage("extract_cache_hit", serial, files=len(paths), rows_of=rows_of)
+    if args.workers > 1:
+        pdf27.TEXT_CACHE = None
+        b.stage(f"extract_pool_{args.workers}", lambda: pdf27.process_pdfs_parallel(paths, args.workers),
+                files=len(paths), rows_of=rows_of)
+
+    detected = {os.path.basename(p): ([e["Erro"] for e in er] or [None])[0] for p, (_, er) in zip(paths, results)}
+    misses = sum(1 for n, code in expected.items() if detected[n] != code)
+
+    offers_rows = [r for of, _ in results for r in of]
+    inc = b.stage("postprocess", lambda: pdf27.postprocess_offers(offers_rows), rows_of=len)
+
+    if args.master_rows:
+        b.stage("gen_master", lambda: generate_master(pdf27.MASTER_OUT, args.master_rows, args.seed),
+                rows_of=lambda n: n)
+        master = b.stage("master_load", pdf27._load_master_df, rows_of=len)
+        b.stage("row_ids", lambda: pdf27.build_row_ids(master), rows_of=len)
+        del master
+        if pdf27.MASTER_LAYOUT == "dataset":
+            # conversão única para o dataset, fora do "merge", que mede o lote em regime
+            b.stage("master_to_dataset", lambda: pdf27._append_to_dataset(pd.DataFrame()),
+                    rows_of=lambda _: args.master_rows)
+    b.stage("merge", lambda: pdf27.export_increment_and_update_master(inc), rows_of=lambda _: len(inc))
+    b.stage("flush", pdf27.flush_batches, rows_of=lambda n: n)
+    if args.xlsx:
+        b.stage("xlsx", pdf27.export_workbook, rows_of=lambda n: sum(n))
+
+    report = {
+        "meta": {
+            "when": datetime.now().isoformat(timespec="seconds"),
+            "git": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "pdfplumber": pdfplumber.__version__,
+            "pandas": pd.__version__,
+            "pyarrow": pa.__version__,
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+            "classification_misses": misses,
+        },
+        "stages": b.stages,
+    }
+    if not args.keep and not args.workdir:
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+def compare(new: dict, old: dict):
+    print(f"{'estágio':<22}{'antes (s)':>12}{'agora (s)':>12}{'razão':>9}", file=sys.stderr)
+    for name, rec in new["stages"].items():
+        prev = old.get("stages", {}).get(name)
+        if not prev:
+            continue
+        ratio = rec["sec"] / prev["sec"] if prev["sec"] else float("nan")
+        print(f"{name:<22}{prev['sec']:>12.3f}{rec['sec']:>12.3f}{ratio:>8.2f}x", file=sys.stderr)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--files", type=int, default=200, help="PDFs sintéticos no corpus.")
+    ap.add_argument("--offers", type=int, default=12, help="Ofertas por PDF.")
+    ap.add_argument("--trailing-pages", type=int, default=1,
+                    help="Páginas após 'complemente sua viagem' em cada PDF de ofertas.")
+    ap.add_argument("--error-share", type=float, default=0.2, help="Fração de PDFs de página de erro.")
+    ap.add_argument("--master-rows", type=int, default=1_000_000, help="Linhas da base-mãe sintética (0 = sem).")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processos no estágio do pool.")
+    ap.add_argument("--xlsx", action="store_true", help="Inclui a exportação da planilha.")
+    ap.add_argument("--seed", type=int, default=27)
+    ap.add_argument("--workdir", help="Diretório de trabalho (padrão: temporário, apagado no fim).")
+    ap.add_argument("--keep", action="store_true", help="Não apaga o diretório temporário.")
+    ap.add_argument("--out", help="Grava o JSON aqui (padrão: stdout).")
+    ap.add_argument("--compare", help="JSON de uma execução anterior para comparar os tempos.")
+    args = ap.parse_args(argv)
+    if args.out:
+        args.out = os.path.abspath(args.out)
+    if args.compare:
+        args.compare = os.path.abspath(args.compare)
+
+    report = run(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(report, json.load(f))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
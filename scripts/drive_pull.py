@@ -1,27 +1,65 @@
-import os, sys, re, io
+import os, sys, re, io, json, time, hashlib, argparse, threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 from datetime import datetime, timedelta, timezone
 
-import pandas as pd
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
-
-FOLDER_ID = os.environ.get("DRIVE_FOLDER_ID") or (sys.argv[1] if len(sys.argv) > 1 else None)
-if not FOLDER_ID:
-    print("Defina DRIVE_FOLDER_ID (secret) ou passe como argumento. Ex.: python scripts/drive_pull.py <FOLDER_ID>", flush=True)
-    sys.exit(1)
+from ofertas_index import FileIndex
+from metrics import Metrics
 
+# As bibliotecas do Google (~0,4 s de import), a credencial e a base-mãe só são
+# carregadas quando usadas: importar este módulo não tem efeito colateral.
+FOLDER_ID = os.environ.get("DRIVE_FOLDER_ID")     # ou argumento de main()/run()
 MAX_FILES = int(os.environ.get("MAX_FILES", "0"))       # 0 = sem limite
 SINCE_HOURS = int(os.environ.get("SINCE_HOURS", "0"))   # 0 = sem filtro por data
 FORCE_REDOWNLOAD = os.environ.get("FORCE_REDOWNLOAD", "0") in ("1","true","yes")
+WORKERS = max(1, int(os.environ.get("DRIVE_WORKERS", "1")))     # downloads simultâneos
+NUM_RETRIES = int(os.environ.get("DRIVE_RETRIES", "5"))         # retry c/ backoff exponencial em 429/5xx
+HTTP_TIMEOUT = int(os.environ.get("DRIVE_HTTP_TIMEOUT", "120"))
+# "list" = lista a pasta inteira a cada run; "changes" = incremental via Changes API
+SYNC_MODE = os.environ.get("DRIVE_SYNC_MODE", "list").strip().lower()
+STATE_FILE = Path(os.environ.get("DRIVE_STATE", "out/DRIVE_STATE.json"))
+DRIVE_ID = os.environ.get("DRIVE_ID") or None                  # só para shared drives
+# download em memória (run(in_memory=True), usado pelo pipeline): o PDF vai direto
+# para o pdf27 e só é gravado em inbox/ se DRIVE_KEEP_ORIGINALS=1
+IN_MEMORY = False
+KEEP_ORIGINALS = os.environ.get("DRIVE_KEEP_ORIGINALS", "0") in ("1","true","yes")
+# bytes por requisição; cada pedaço recebido já fica no .part, então uma queda
+# (ou o fim das tentativas em 429/5xx) retoma do último pedaço, não do zero
+CHUNK_SIZE = max(256 * 1024, int(float(os.environ.get("DRIVE_CHUNK_MB", "10")) * 1024 * 1024))
+RESUME_ATTEMPTS = int(os.environ.get("DRIVE_RESUME_ATTEMPTS", "3"))   # retomadas por arquivo no mesmo run
+
+METRICS = Metrics("drive_pull")    # listagem, downloads e bytes por arquivo
 
 OUT_DIR = Path("./inbox")
-OUT_DIR.mkdir(parents=True, exist_ok=True)
 
 SCOPES = ["https://www.googleapis.com/auth/drive.readonly"]
-creds = Credentials.from_service_account_file("sa.json", scopes=SCOPES)
-service = build("drive", "v3", credentials=creds)
+SA_FILE = os.environ.get("GDRIVE_SA_FILE", "sa.json")
+_creds = None
+_creds_lock = threading.Lock()
+
+def get_credentials():
+    global _creds
+    with _creds_lock:
+        if _creds is None:
+            from google.oauth2.service_account import Credentials
+            _creds = Credentials.from_service_account_file(SA_FILE, scopes=SCOPES)
+        return _creds
+
+# httplib2 não é thread-safe: cada thread tem seu próprio cliente HTTP (e
+# reaproveita a conexão entre as requisições dessa thread).
+_local = threading.local()
+
+def get_service():
+    svc = getattr(_local, "service", None)
+    if svc is None:
+        import httplib2
+        from google_auth_httplib2 import AuthorizedHttp
+        from googleapiclient.discovery import build
+        http = AuthorizedHttp(get_credentials(), http=httplib2.Http(timeout=HTTP_TIMEOUT))
+        # documento de discovery empacotado na biblioteca: nenhuma requisição extra
+        svc = build("drive", "v3", http=http, cache_discovery=False, static_discovery=True)
+        _local.service = svc
+    return svc
 
 def safe(name: str) -> str:
     return re.sub(r'[\\/:*?"<>|]+', "_", name)
@@ -29,56 +67,209 @@ def safe(name: str) -> str:
 def iso_utc(dt: datetime) -> str:
     return dt.replace(tzinfo=timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
 
-# --- ler base-mãe (prioriza raiz do repo) ---
-MASTER_CANDIDATES = [
+# --- o que já foi convertido ---
+# Fonte principal: índice local por md5 do conteúdo (ofertas_index.py), consultado
+# com o md5Checksum da listagem, sem baixar nada. Enquanto o índice estiver vazio
+# (primeiro run numa máquina nova) cai no legado: nomes de arquivo da base-mãe.
+MASTER_CANDIDATES = [             # mesma ordem do pdf27: a cópia de trabalho em out/ primeiro
+    Path("out/OFERTAS"),            # dataset particionado (layout padrão do pdf27)
+    Path("out/OFERTAS.parquet"),    # pdf27 --single-file, ou ainda não convertida
     Path("OFERTAS.parquet"),
     Path("data/OFERTAS.parquet"),
-    Path("out/OFERTAS.parquet"),
 ]
 
 def load_master_filenames() -> set[str]:
+    import pyarrow.dataset as ds
     for p in MASTER_CANDIDATES:
         if p.exists():
             try:
-                df = pd.read_parquet(p)
-                if "Nome do Arquivo" in df:
-                    names = (
-                        df["Nome do Arquivo"]
-                        .dropna().astype(str).str.strip().str.upper().unique().tolist()
-                    )
-                    return set(names)
+                d = ds.dataset(p, format="parquet", partitioning="hive")
+                if "Nome do Arquivo" not in d.schema.names:
+                    continue
+                col = d.to_table(columns=["Nome do Arquivo"]).column(0).to_pylist()
+                return {str(v).strip().upper() for v in col if v is not None}
             except Exception as e:
                 print(f"[aviso] Não consegui ler {p}: {e}")
     return set()
 
-MASTER_NAMES = load_master_filenames()
-if MASTER_NAMES and not FORCE_REDOWNLOAD:
-    print(f"[skip-master] {len(MASTER_NAMES):,} nomes encontrados na base-mãe. "
-          f"Arquivos com o mesmo nome serão pulados.", flush=True)
-elif FORCE_REDOWNLOAD:
-    print("[skip-master] FORÇADO a baixar tudo (FORCE_REDOWNLOAD=1).", flush=True)
-else:
-    print("[skip-master] Base-mãe não encontrada; baixando normalmente.", flush=True)
+INDEX = None
+MASTER_NAMES = None                 # carregado no 1º PDF a decidir (só com o índice vazio)
+_master_lock = threading.Lock()
+
+def init_skip_sources():
+    global INDEX, MASTER_NAMES
+    if FORCE_REDOWNLOAD:
+        print("[skip-master] FORÇADO a baixar tudo (FORCE_REDOWNLOAD=1).", flush=True)
+        return
+    INDEX = FileIndex()
+    if len(INDEX):
+        MASTER_NAMES = set()
+        print(f"[skip-index] {len(INDEX):,} conteúdos já convertidos no índice "
+              f"{INDEX.path}; arquivos com o mesmo md5 serão pulados.", flush=True)
+        return
+    MASTER_NAMES = None
+    print("[skip-master] índice vazio; a base-mãe será consultada pelos nomes de arquivo.", flush=True)
+
+def master_names() -> set[str]:
+    """Nomes da base-mãe, lidos uma vez e só se algum PDF precisar (run sem nada a
+    baixar nunca abre o parquet)."""
+    global MASTER_NAMES
+    with _master_lock:
+        if MASTER_NAMES is None:
+            MASTER_NAMES = load_master_filenames()
+            if MASTER_NAMES:
+                print(f"[skip-master] {len(MASTER_NAMES):,} nomes encontrados na base-mãe. "
+                      f"Arquivos com o mesmo nome serão pulados.", flush=True)
+            else:
+                print("[skip-master] Índice e base-mãe não encontrados; baixando normalmente.", flush=True)
+        return MASTER_NAMES
+
+def already_converted(f: dict) -> bool:
+    if INDEX is not None and INDEX.is_parsed(f.get("md5Checksum")):
+        print(f"[pulei-indice] {f['name']} já convertido (md5 {f['md5Checksum']})", flush=True)
+        return True
+    return False
 
 def should_skip_pdf(dest_name: str) -> bool:
-    if FORCE_REDOWNLOAD or not MASTER_NAMES:
+    if FORCE_REDOWNLOAD or INDEX is None:
         return False
-    return dest_name.strip().upper() in MASTER_NAMES
+    return dest_name.strip().upper() in master_names()
+
+class Download:
+    """Arquivo baixado em memória: conteúdo e hashes calculados durante o download.
+    `path` é onde ele estaria em inbox/ (e onde fica, com DRIVE_KEEP_ORIGINALS=1)."""
+    def __init__(self, path: Path, data: bytes, md5: str, sha1: str):
+        self.path, self.data, self.md5, self.sha1 = path, data, md5, sha1
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+    def __str__(self):
+        return str(self.path)
+
+class _Sink:
+    """Destino de um download (arquivo .part ou memória) que calcula md5/sha1 no
+    caminho. Um .part já existente é continuado: seus bytes entram no hash."""
+    def __init__(self, part: Path | None):
+        self.part = part
+        self.md5, self.sha1, self.size = hashlib.md5(), hashlib.sha1(), 0
+        self._fh = io.BytesIO() if part is None else open(part, "a+b")
+        if part is not None:
+            self._fh.seek(0)
+            for chunk in iter(lambda: self._fh.read(1 << 20), b""):
+                self._update(chunk)
+
+    def _update(self, b):
+        self.md5.update(b); self.sha1.update(b); self.size += len(b)
+
+    def write(self, b):
+        self._update(b)
+        return self._fh.write(b)
 
-def download_binary(file_id: str, name: str, mime: str):
+    def restart(self):
+        self._fh.seek(0); self._fh.truncate()
+        self.md5, self.sha1, self.size = hashlib.md5(), hashlib.sha1(), 0
+
+    def getvalue(self) -> bytes:
+        return self._fh.getvalue()
+
+    def close(self):
+        self._fh.close()
+
+PARTIAL_DIR = OUT_DIR / ".partial"      # fora do glob inbox/*.pdf do pdf27
+
+def _record_transfer(kind: str, dest: Path, mime: str, size: int, sec: float, resumed: int = 0):
+    METRICS.observe(kind, sec)
+    METRICS.count(f"{kind}_bytes", size)
+    if resumed:
+        METRICS.count(f"{kind}_resumed_bytes", resumed)
+    METRICS.file(dest.name, kind=kind, mime=mime, bytes=size, total=round(sec, 4), resumed=resumed,
+                 mb_per_sec=round(size / sec / 1e6, 3) if sec else None)
+
+def _fetch_into(sink: _Sink, make_request):
+    """Baixa para `sink` a partir de sink.size, um pedaço de CHUNK_SIZE por requisição
+    com Range explícito (só API pública do cliente: nada de estado interno do
+    MediaIoBaseDownload). Termina quando o Content-Range mostra que chegou ao fim."""
+    while True:
+        request = make_request()
+        request.headers["range"] = f"bytes={sink.size}-{sink.size + CHUNK_SIZE - 1}"
+        resp = {}
+        request.add_response_callback(lambda r: resp.update(r, status=r.status))
+        body = request.execute(num_retries=NUM_RETRIES)
+        if resp["status"] != 206:               # servidor ignorou o Range: veio o arquivo inteiro
+            sink.restart()
+            sink.write(body)
+            return
+        sink.write(body)
+        total = resp.get("content-range", "").rpartition("/")[2]
+        if (sink.size >= int(total)) if total.isdigit() else len(body) < CHUNK_SIZE:
+            return
+
+def _receive(make_request, dest: Path, kind: str, mime: str, file_id: str, md5: str | None = None) -> Path | Download:
+    """Baixa para um .part (ou memória, com IN_MEMORY) e só então entrega: em disco
+    o .part vira `dest` por rename atômico, então o pdf27 nunca vê arquivo truncado.
+
+    Com `md5` (binários; exportações não têm) o conteúdo é conferido no fim e o
+    .part é nomeado por id+md5, o que permite retomar por Range tanto depois de
+    uma falha neste run quanto de um run interrompido. Sem md5 a retomada
+    recomeça do zero, já que cada exportação é gerada de novo."""
+    part = None
+    if not IN_MEMORY:
+        PARTIAL_DIR.mkdir(parents=True, exist_ok=True)
+        part = PARTIAL_DIR / (f"{file_id}-{md5}.part" if md5 else f"{file_id}.part")
+        if not md5:
+            part.unlink(missing_ok=True)
+    t0 = time.perf_counter()
+    sink = _Sink(part)
+    resumed = sink.size
+    try:
+        for attempt in range(RESUME_ATTEMPTS + 1):
+            try:
+                _fetch_into(sink, make_request)
+                break
+            except Exception as e:
+                if getattr(getattr(e, "resp", None), "status", None) == 416:
+                    break                       # nada depois do que já temos: .part completo (run caiu antes do rename)
+                if attempt == RESUME_ATTEMPTS:
+                    raise
+                if not md5:
+                    sink.restart()
+                print(f"[retomada] {dest.name}: {e}; continuando do byte {sink.size:,}", flush=True)
+        if md5 and sink.md5.hexdigest() != md5:
+            got = sink.md5.hexdigest()
+            sink.close()
+            if part is not None:
+                part.unlink(missing_ok=True)    # .part não serve para retomar: descarta
+            raise IOError(f"md5 não confere ({got} ≠ {md5})")
+        data = sink.getvalue() if IN_MEMORY else None
+    finally:
+        sink.close()
+
+    if IN_MEMORY:
+        item = Download(dest, data, sink.md5.hexdigest(), sink.sha1.hexdigest())
+        if KEEP_ORIGINALS:
+            tmp = dest.with_name(dest.name + ".part")
+            tmp.write_bytes(item.data)
+            os.replace(tmp, dest)
+    else:
+        os.replace(part, dest)
+        for stale in PARTIAL_DIR.glob(f"{file_id}-*.part"):     # versões antigas do mesmo arquivo
+            stale.unlink(missing_ok=True)
+        item = dest
+    _record_transfer(kind, dest, mime, sink.size, time.perf_counter() - t0, resumed)
+    return item
+
+def download_binary(file_id: str, name: str, mime: str, md5: str | None = None):
     dest = OUT_DIR / safe(name)
     if dest.suffix.lower() == ".pdf" and should_skip_pdf(dest.name):
         print(f"[pulei-base] {dest.name} já consta no OFERTAS.parquet", flush=True)
         return False
 
-    request = service.files().get_media(fileId=file_id)
-    with io.FileIO(dest, "wb") as fh:
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while not done:
-            _, done = downloader.next_chunk()
+    saved = _receive(lambda: get_service().files().get_media(fileId=file_id), dest, "download", mime,
+                     file_id, md5)
     print(f"[ok] {dest.name} ({mime})", flush=True)
-    return True
+    return saved
 
 def export_google_file(file_id: str, name: str, mime: str):
     if mime == "application/vnd.google-apps.spreadsheet":
@@ -96,56 +287,231 @@ def export_google_file(file_id: str, name: str, mime: str):
         print(f"[pulei-base] {dest.name} já consta no OFERTAS.parquet", flush=True)
         return False
 
-    request = service.files().export_media(fileId=file_id, mimeType=export_mime)
-    with io.FileIO(dest, "wb") as fh:
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while not done:
-            _, done = downloader.next_chunk()
+    saved = _receive(lambda: get_service().files().export_media(fileId=file_id, mimeType=export_mime),
+                     dest, "export", mime, file_id)
     print(f"[ok-export] {dest.name} ({mime} → {export_mime})", flush=True)
-    return True
+    return saved
+
+# --- estado do sync incremental (startPageToken + id/md5/modifiedTime por arquivo) ---
+def load_sync_state() -> dict:
+    try:
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            st = json.load(f)
+        if isinstance(st, dict):
+            st.setdefault("files", {})
+            return st
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"[aviso] Estado {STATE_FILE} ilegível ({e}); começando do zero.", flush=True)
+    return {"start_page_token": None, "files": {}}
 
-def run():
+def save_sync_state(state: dict):
+    STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = STATE_FILE.with_name(STATE_FILE.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp, STATE_FILE)
+
+def forget_files(state: dict, file_ids, token: str | None):
+    """Desfaz o sync de `file_ids`, baixados mas não aproveitados por quem os
+    consumiu: saem do estado e o token volta a `token` (o do início do run), como
+    quando um download falha. O próximo sync os baixa de novo; o resto é pulado
+    pelo md5."""
+    file_ids = set(file_ids)
+    for fid in file_ids:
+        state["files"].pop(fid, None)
+    if file_ids:
+        state["start_page_token"] = token
+
+def already_synced(f: dict, state: dict) -> bool:
+    if FORCE_REDOWNLOAD:
+        return False
+    known = state["files"].get(f["id"])
+    if not known:
+        return False
+    if f.get("md5Checksum"):
+        return known.get("md5Checksum") == f["md5Checksum"]
+    return known.get("modifiedTime") == f.get("modifiedTime")
+
+FILE_FIELDS = "id, name, mimeType, md5Checksum, modifiedTime, parents, trashed"
+
+def iter_folder_files(cursor: dict):
+    """Lista a pasta inteira (filtrada por SINCE_HOURS), página a página."""
     q = f"'{FOLDER_ID}' in parents and trashed=false"
     if SINCE_HOURS > 0:
         since = datetime.utcnow() - timedelta(hours=SINCE_HOURS)
         q += f" and modifiedTime >= '{iso_utc(since)}'"
 
-    downloaded = 0
     page_token = None
     while True:
-        page_size = min(MAX_FILES - downloaded, 100) if MAX_FILES > 0 else 100
-        if page_size <= 0:
-            break
-
-        resp = service.files().list(
+        t0 = time.perf_counter()
+        resp = get_service().files().list(
             q=q,
-            fields="nextPageToken, files(id, name, mimeType)",
+            fields=f"nextPageToken, files({FILE_FIELDS})",
             orderBy="modifiedTime desc",
-            pageSize=page_size,
+            pageSize=100,
             includeItemsFromAllDrives=True,
             supportsAllDrives=True,
             pageToken=page_token,
-        ).execute()
+        ).execute(num_retries=NUM_RETRIES)
+        METRICS.observe("list", time.perf_counter() - t0)
+        cursor["page"] = page_token
+        yield from resp.get("files", [])
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            return
 
-        files = resp.get("files", [])
-        if not files:
-            break
+def get_start_page_token() -> str:
+    kw = {"driveId": DRIVE_ID} if DRIVE_ID else {}
+    with METRICS.timer("start_token"):
+        resp = get_service().changes().getStartPageToken(supportsAllDrives=True, **kw).execute(num_retries=NUM_RETRIES)
+    return resp["startPageToken"]
 
-        for f in files:
-            fid, name, mime = f["id"], f["name"], f.get("mimeType", "")
-            ok = export_google_file(fid, name, mime) if mime.startswith("application/vnd.google-apps") else download_binary(fid, name, mime)
+def iter_changed_files(token: str, cursor: dict):
+    """Arquivos da pasta alterados desde `token`; ao fim, cursor["new"] recebe o próximo token."""
+    kw = {"driveId": DRIVE_ID} if DRIVE_ID else {}
+    page_token = token
+    while page_token:
+        t0 = time.perf_counter()
+        resp = get_service().changes().list(
+            pageToken=page_token,
+            fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}))",
+            pageSize=100,
+            spaces="drive",
+            includeItemsFromAllDrives=True,
+            supportsAllDrives=True,
+            **kw,
+        ).execute(num_retries=NUM_RETRIES)
+        METRICS.observe("list", time.perf_counter() - t0)
+        cursor["page"] = page_token
+        for ch in resp.get("changes", []):
+            f = ch.get("file")
+            if ch.get("removed") or not f or f.get("trashed"):
+                continue
+            if FOLDER_ID in (f.get("parents") or []):
+                yield f
+        if resp.get("newStartPageToken"):
+            cursor["new"] = resp["newStartPageToken"]
+        page_token = resp.get("nextPageToken")
+
+def fetch_file(f: dict) -> Path | Download | bool | None:
+    """Caminho salvo (ou Download, em memória) = baixado, False = pulado, None = falhou."""
+    fid, name, mime = f["id"], f["name"], f.get("mimeType", "")
+    try:
+        if mime.startswith("application/vnd.google-apps"):
+            return export_google_file(fid, name, mime)
+        return download_binary(fid, name, mime, f.get("md5Checksum"))
+    except Exception as e:
+        print(f"[erro] {name}: {e}", flush=True)
+        return None
+
+def download_all(files, state: dict, cursor: dict, on_file=None) -> dict:
+    """Baixa `files` no pool. A listagem (o iterador) segue na thread principal
+    enquanto os downloads rodam. `on_file(caminho, id)` é chamado a cada arquivo salvo.
+    Devolve contadores do run."""
+    stats = {"downloaded": 0, "failed": 0, "skipped": 0, "limit": False}
+    pending = {}
+
+    def collect(block: bool):
+        if not pending:
+            return
+        done, _ = wait(pending, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for fut in done:
+            f, ok = pending.pop(fut), fut.result()
             if ok:
-                downloaded += 1
-                if MAX_FILES > 0 and downloaded >= MAX_FILES:
-                    print(f"[fim] limite atingido: {downloaded} arquivo(s) salvos em {OUT_DIR}", flush=True)
-                    return
+                stats["downloaded"] += 1
+                state["files"][f["id"]] = {k: f.get(k) for k in ("name", "md5Checksum", "modifiedTime")}
+                if on_file is not None:
+                    on_file(ok, f["id"])
+            elif ok is None:
+                stats["failed"] += 1
 
-        page_token = resp.get("nextPageToken")
-        if not page_token:
-            break
+    def limit_reached() -> bool:
+        return MAX_FILES > 0 and stats["downloaded"] >= MAX_FILES
+
+    with ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="drive") as pool:
+        for f in files:
+            if already_synced(f, state) or already_converted(f):
+                stats["skipped"] += 1
+                continue
+            collect(block=False)
+            # não dispara mais downloads do que o limite ainda permite
+            while pending and (len(pending) >= WORKERS * 4
+                               or (MAX_FILES > 0 and stats["downloaded"] + len(pending) >= MAX_FILES)):
+                collect(block=True)
+            if limit_reached():
+                stats["limit"] = True
+                break
+            pending[pool.submit(fetch_file, f)] = f
+        while pending:
+            collect(block=True)
+    stats["limit"] = stats["limit"] or limit_reached()
+    return stats
+
+def run(on_file=None, folder_id=None, in_memory=False, save_state=True) -> dict:
+    """Um sync da pasta `folder_id` (ou DRIVE_FOLDER_ID) para inbox/. Com `in_memory`,
+    `on_file` recebe Downloads em vez de caminhos. Com save_state=False o estado do
+    sync é só devolvido: quem consome os downloads grava (save_sync_state) depois de
+    processá-los, senão uma queda no meio perderia arquivos que não estão em disco."""
+    global FOLDER_ID, IN_MEMORY
+    from googleapiclient.errors import HttpError
+    FOLDER_ID = folder_id or FOLDER_ID
+    IN_MEMORY = in_memory
+    if not FOLDER_ID:
+        raise ValueError("pasta do Drive não definida (DRIVE_FOLDER_ID)")
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    init_skip_sources()
+    state = load_sync_state()
+    cursor = {}
+    token = state.get("start_page_token") if SYNC_MODE == "changes" else None
+
+    stats = None
+    if token:
+        try:
+            print(f"[sync] incremental a partir do token {token}", flush=True)
+            stats = download_all(iter_changed_files(token, cursor), state, cursor, on_file)
+        except HttpError as e:
+            if e.resp.status not in (400, 403, 404, 410):
+                raise
+            print(f"[sync] token inválido ({e.resp.status}); voltando à listagem completa.", flush=True)
+            state["start_page_token"] = None
+            cursor = {}
+
+    if stats is None:
+        # pega o token ANTES de listar para não perder o que mudar durante a listagem
+        new_token = get_start_page_token() if SYNC_MODE == "changes" else None
+        stats = download_all(iter_folder_files(cursor), state, cursor, on_file)
+        if new_token and not stats["limit"] and not stats["failed"]:
+            state["start_page_token"] = new_token
+    elif stats["limit"]:
+        # relê a página interrompida no próximo run; o que já baixou é pulado pelo md5
+        state["start_page_token"] = cursor.get("page") or token
+    elif not stats["failed"] and cursor.get("new"):
+        state["start_page_token"] = cursor["new"]
+
+    if save_state:
+        save_sync_state(state)
+    METRICS.flush(mode=SYNC_MODE, **{k: stats[k] for k in ("downloaded", "skipped", "failed", "limit")})
+
+    where = "memória" if IN_MEMORY and not KEEP_ORIGINALS else OUT_DIR
+    extra = f" ({stats['skipped']} já sincronizado(s), {stats['failed']} falha(s))"
+    if stats["limit"]:
+        print(f"[fim] limite atingido: {stats['downloaded']} arquivo(s) salvos em {where}{extra}", flush=True)
+    else:
+        print(f"[fim] {stats['downloaded']} arquivo(s) salvos em {where}{extra}", flush=True)
+    return state
 
-    print(f"[fim] {downloaded} arquivo(s) salvos em {OUT_DIR}", flush=True)
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Baixa a pasta do Drive para inbox/.")
+    ap.add_argument("folder", nargs="?", default=FOLDER_ID,
+                    help="ID da pasta do Drive (env DRIVE_FOLDER_ID).")
+    args = ap.parse_args(argv)
+    if not args.folder:
+        print("Defina DRIVE_FOLDER_ID (secret) ou passe como argumento. Ex.: python scripts/drive_pull.py <FOLDER_ID>", flush=True)
+        return 1
+    run(folder_id=args.folder)
+    return 0
 
 if __name__ == "__main__":
-    run()
+    sys.exit(main())
@@ -0,0 +1,128 @@
+# scripts/inbox_watch.py
+"""Observa a pasta de entrada e entrega lotes de PDFs recém-chegados.
+
+No Linux usa inotify (via ctypes, sem dependência extra) e reage a IN_CLOSE_WRITE /
+IN_MOVED_TO, ou seja, a arquivos já terminados de escrever ou renomeados para o
+nome final. Fora do Linux (ou se o inotify falhar) cai num polling que só lista
+nomes e considera pronto o arquivo cujo tamanho não mudou entre duas passadas.
+"""
+import os, time, errno, select, struct, ctypes, ctypes.util
+from pathlib import Path
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO    = 0x00000080
+IN_Q_OVERFLOW  = 0x00004000
+IN_NONBLOCK    = 0o4000
+IN_CLOEXEC     = 0o2000000
+_EVENT = struct.Struct("iIII")
+
+class _Inotify:
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, "inotify_add_watch")
+        self.overflow = False
+
+    def read(self, timeout: float | None) -> list[str]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        names, pos = [], 0
+        while pos + _EVENT.size <= len(buf):
+            _, mask, _, length = _EVENT.unpack_from(buf, pos)
+            pos += _EVENT.size
+            name = buf[pos:pos + length].rstrip(b"\0").decode(errors="surrogateescape")
+            pos += length
+            if mask & IN_Q_OVERFLOW:
+                self.overflow = True
+            elif name:
+                names.append(name)
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+class _Poller:
+    def __init__(self, directory: str, interval: float):
+        self.directory, self.interval = directory, interval
+        self.known = set(os.listdir(directory))
+        self.growing = {}                       # nome -> último tamanho visto
+        self.overflow = False
+
+    def read(self, timeout: float | None) -> list[str]:
+        time.sleep(self.interval if timeout is None else min(self.interval, timeout))
+        names = set(os.listdir(self.directory))
+        ready = []
+        for name in (names - self.known) | set(self.growing):
+            try:
+                size = os.stat(os.path.join(self.directory, name)).st_size
+            except FileNotFoundError:
+                self.growing.pop(name, None)
+                continue
+            if self.growing.get(name) == size:
+                ready.append(name)
+                del self.growing[name]
+            else:
+                self.growing[name] = size
+        self.known = names - set(self.growing)
+        return ready
+
+    def close(self):
+        pass
+
+def watch_batches(directory: str, suffix: str = ".pdf", debounce: float = 2.0,
+                  max_wait: float = 30.0, poll_interval: float = 5.0, use_inotify: bool = True):
+    """Gera listas ordenadas de caminhos novos. Um lote fecha quando passam
+    `debounce` segundos sem chegadas ou `max_wait` segundos desde a primeira.
+    Um lote None sinaliza que eventos foram perdidos (overflow): reescaneie a pasta.
+
+    O observador é armado já nesta chamada, não no primeiro next(): o que chegar
+    enquanto o chamador faz a varredura inicial da pasta também é entregue."""
+    os.makedirs(directory, exist_ok=True)
+    source = None
+    if use_inotify:
+        try:
+            source = _Inotify(directory)
+        except (OSError, AttributeError):
+            source = None
+    if source is None:
+        source = _Poller(directory, poll_interval)
+    return _batches(source, directory, suffix, debounce, max_wait)
+
+def _batches(source, directory: str, suffix: str, debounce: float, max_wait: float):
+    try:
+        while True:
+            batch, first = set(), None
+            while True:
+                if first is None:
+                    timeout = None
+                else:
+                    timeout = min(debounce, max(0.0, first + max_wait - time.monotonic()))
+                names = [n for n in source.read(timeout) if n.lower().endswith(suffix)]
+                if source.overflow:
+                    source.overflow = False
+                    yield None
+                    batch, first = set(), None
+                    continue
+                if names:
+                    batch.update(names)
+                    first = first or time.monotonic()
+                elif batch:
+                    break
+                if first is not None and time.monotonic() - first >= max_wait:
+                    break
+            yield sorted(str(Path(directory) / n) for n in batch)
+    finally:
+        source.close()
@@ -0,0 +1,137 @@
+# scripts/metrics.py
+"""Métricas de execução do pdf27 e do drive_pull: tempo por estágio, por arquivo e
+totais de cada ciclo.
+
+Com METRICS_JSONL=<arquivo> cada ciclo vira, no fim, linhas JSON nesse arquivo (uma
+por arquivo e uma de resumo, com os N mais lentos); o arquivo só cresce, então fica
+desligado por padrão. Com METRICS_PROM_DIR, um <job>.prom no formato textfile do
+node_exporter (sobrescrito a cada ciclo).
+
+Com PDF27_PROFILE_SLOWEST=N cada PDF roda sob cProfile; ao fechar o ciclo ficam
+em PDF27_PROFILE_DIR só os .prof dos N arquivos mais lentos.
+"""
+import os, json, time, socket, cProfile, threading
+from contextlib import contextmanager
+
+METRICS_JSONL = os.environ.get("METRICS_JSONL", "").strip()      # vazio (padrão) desliga
+METRICS_PROM_DIR = os.environ.get("METRICS_PROM_DIR", "").strip()
+SLOWEST_N = int(os.environ.get("METRICS_SLOWEST", "10"))
+PROFILE_SLOWEST = int(os.environ.get("PDF27_PROFILE_SLOWEST", "0"))
+PROFILE_DIR = os.environ.get("PDF27_PROFILE_DIR", "out/PROFILES")
+
+def _prom_label(value) -> str:
+    # escapes do formato de exposição: barra invertida, aspas e quebra de linha
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _profile_path(name: str) -> str:
+    return os.path.join(PROFILE_DIR, os.path.basename(name) + ".prof")
+
+def call_profiled(name: str, fn, *args):
+    """fn(*args), sob cProfile quando PDF27_PROFILE_SLOWEST > 0."""
+    if PROFILE_SLOWEST <= 0:
+        return fn(*args)
+    prof = cProfile.Profile()
+    try:
+        return prof.runcall(fn, *args)
+    finally:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        prof.dump_stats(_profile_path(name))
+
+class Metrics:
+    def __init__(self, job: str):
+        self.job = job
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.stages = {}                    # estágio -> [ocorrências, segundos]
+            self.counters = {}
+            self.files = []
+
+    def observe(self, stage: str, sec: float):
+        with self._lock:
+            rec = self.stages.setdefault(stage, [0, 0.0])
+            rec[0] += 1; rec[1] += sec
+
+    @contextmanager
+    def timer(self, stage: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - t0)
+
+    def count(self, name: str, n: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def file(self, name: str, **fields):
+        """Registro de um arquivo; `total` (segundos) ordena os mais lentos."""
+        with self._lock:
+            self.files.append({"file": os.path.basename(name), **fields})
+
+    def slowest(self, n: int = SLOWEST_N) -> list:
+        return sorted(self.files, key=lambda r: r.get("total", 0.0), reverse=True)[:n]
+
+    def summary(self, **extra) -> dict:
+        return {
+            "type": "cycle", "job": self.job, "host": socket.gethostname(),
+            "ts": round(time.time(), 3), "duration_sec": round(time.time() - self.started, 4),
+            "stages": {k: {"count": c, "sec": round(s, 4)} for k, (c, s) in sorted(self.stages.items())},
+            "counters": dict(sorted(self.counters.items())),
+            "files": len(self.files),
+            "slowest": self.slowest(),
+            **extra,
+        }
+
+    def flush(self, **extra) -> dict:
+        """Fecha o ciclo: grava JSONL/Prometheus, poda os profiles e zera o coletor."""
+        summary = self.summary(**extra)
+        if METRICS_JSONL:
+            os.makedirs(os.path.dirname(METRICS_JSONL) or ".", exist_ok=True)
+            with open(METRICS_JSONL, "a", encoding="utf-8") as f:
+                for rec in self.files:
+                    f.write(json.dumps({"type": "file", "job": self.job, "ts": summary["ts"], **rec},
+                                       ensure_ascii=False) + "\n")
+                f.write(json.dumps(summary, ensure_ascii=False) + "\n")
+        if METRICS_PROM_DIR:
+            self._write_prom(summary)
+        if PROFILE_SLOWEST > 0 and self.files:
+            self._prune_profiles()
+        self.reset()
+        return summary
+
+    def _write_prom(self, summary: dict):
+        job, lines = self.job, []
+        def metric(name, help_, samples):
+            lines.append(f"# HELP {job}_{name} {help_}")
+            lines.append(f"# TYPE {job}_{name} gauge")
+            for labels, value in samples:
+                lab = ",".join(f'{k}="{_prom_label(v)}"' for k, v in labels.items())
+                lines.append(f"{job}_{name}{{{lab}}} {value}" if lab else f"{job}_{name} {value}")
+        metric("cycle_duration_seconds", "Duração do último ciclo.", [({}, summary["duration_sec"])])
+        metric("cycle_timestamp_seconds", "Fim do último ciclo (epoch).", [({}, summary["ts"])])
+        metric("files", "Arquivos registrados no último ciclo.", [({}, summary["files"])])
+        metric("stage_seconds", "Tempo por estágio no último ciclo.",
+               [({"stage": k}, v["sec"]) for k, v in summary["stages"].items()])
+        metric("stage_count", "Ocorrências por estágio no último ciclo.",
+               [({"stage": k}, v["count"]) for k, v in summary["stages"].items()])
+        metric("counter", "Contadores do último ciclo.",
+               [({"name": k}, v) for k, v in summary["counters"].items()])
+        if summary["slowest"]:
+            metric("slowest_file_seconds", "Arquivo mais lento do último ciclo.",
+                   [({"file": summary["slowest"][0]["file"]}, summary["slowest"][0].get("total", 0))])
+        os.makedirs(METRICS_PROM_DIR, exist_ok=True)
+        path = os.path.join(METRICS_PROM_DIR, f"{job}.prom")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(path + ".tmp", path)
+
+    def _prune_profiles(self):
+        keep = {_profile_path(r["file"]) for r in self.slowest(PROFILE_SLOWEST)}
+        for r in self.files:
+            p = _profile_path(r["file"])
+            if p not in keep and os.path.exists(p):
+                os.remove(p)
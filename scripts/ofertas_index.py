@@ -0,0 +1,145 @@
+# scripts/ofertas_index.py
+"""Índice local de conteúdo já convertido, compartilhado por drive_pull.py e pdf27.py.
+
+Cada PDF convertido é registrado pelo md5 do conteúdo (o mesmo valor que o Drive
+expõe em md5Checksum) e pelo sha1. Com isso o drive_pull decide se precisa baixar
+um arquivo só pelos metadados da listagem, e o pdf27 pula conteúdo repetido mesmo
+com outro nome, sem nenhum dos dois carregar o OFERTAS.parquet.
+
+No mesmo banco fica o estado por arquivo da inbox/ (FileState): assinatura
+(tamanho+mtime), situação, linhas e erro de cada PDF já visto.
+"""
+import os, json, time, sqlite3, hashlib
+from pathlib import Path
+
+INDEX_PATH = Path(os.environ.get("OFERTAS_INDEX", "out/OFERTAS_INDEX.sqlite"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS parsed (
+    md5        TEXT PRIMARY KEY,
+    sha1       TEXT NOT NULL,
+    name       TEXT NOT NULL,
+    size       INTEGER,
+    rows       INTEGER,
+    parsed_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS parsed_name ON parsed(name);
+CREATE TABLE IF NOT EXISTS files (
+    path        TEXT PRIMARY KEY,
+    sig         TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    md5         TEXT,
+    rows        INTEGER,
+    errors      INTEGER,
+    error       TEXT,
+    updated_at  REAL NOT NULL
+);
+"""
+
+def _connect(path: Path) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(str(path), timeout=30)
+    db.execute("PRAGMA journal_mode=WAL")      # leitores não bloqueiam o gravador
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(_SCHEMA)
+    return db
+
+def file_hashes(path) -> tuple[str, str, int]:
+    """(md5, sha1, tamanho) do arquivo, numa única leitura."""
+    md5, sha1, size = hashlib.md5(), hashlib.sha1(), 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            md5.update(chunk); sha1.update(chunk); size += len(chunk)
+    return md5.hexdigest(), sha1.hexdigest(), size
+
+class FileIndex:
+    def __init__(self, path=INDEX_PATH):
+        self.path = Path(path)
+        self._db = _connect(self.path)
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM parsed").fetchone()[0]
+
+    def is_parsed(self, md5: str | None) -> bool:
+        if not md5:
+            return False
+        return self._db.execute("SELECT 1 FROM parsed WHERE md5 = ?", (md5,)).fetchone() is not None
+
+    def sha1_by_name(self) -> dict:
+        """{NOME EM CAIXA ALTA: (nome, sha1)}, com o registro mais recente de cada nome."""
+        rows = self._db.execute("SELECT name, sha1 FROM parsed ORDER BY parsed_at")
+        return {name.upper(): (name, sha1) for name, sha1 in rows}
+
+    def mark_parsed(self, entries):
+        """entries: iterável de (md5, sha1, name, size, rows)."""
+        now = time.time()
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO parsed (md5, sha1, name, size, rows, parsed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(*e, now) for e in entries],
+            )
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class FileState:
+    """Estado por arquivo da inbox/. Chaves são caminhos relativos à pasta de
+    entrada; gravações vão em lote, numa transação por chamada de mark()."""
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = Path(path)
+        self._db = _connect(self.path)
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def sig(self, key: str) -> str | None:
+        row = self._db.execute("SELECT sig FROM files WHERE path = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def mark(self, entries):
+        """entries: iterável de (path, sig, status, md5, rows, errors, error)."""
+        now = time.time()
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO files (path, sig, status, md5, rows, errors, error, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(*e, now) for e in entries],
+            )
+
+    def prune(self, keep) -> int:
+        """Remove as entradas cujo caminho não está em `keep` (arquivos apagados)."""
+        keep = set(keep)
+        gone = [(p,) for (p,) in self._db.execute("SELECT path FROM files") if p not in keep]
+        if gone:
+            with self._db:
+                self._db.executemany("DELETE FROM files WHERE path = ?", gone)
+        return len(gone)
+
+    def import_json(self, json_path, key=lambda p: p) -> int:
+        """Migra o estado antigo ({caminho: assinatura}) sem sobrescrever o que já existe."""
+        with open(json_path, "r", encoding="utf-8") as f:
+            old = json.load(f)
+        now = time.time()
+        rows = [(key(p), sig, "ok", None, None, None, None, now)
+                for p, sig in old.items() if isinstance(sig, str)]
+        with self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO files (path, sig, status, md5, rows, errors, error, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
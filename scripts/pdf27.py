@@ -1,37 +1,87 @@
 # scripts/pdf27.py
-import os, re, glob, json, time, argparse, logging, hashlib
+from __future__ import annotations
+
+import io, os, re, sys, glob, time, uuid, shutil, fnmatch, argparse, logging, hashlib, importlib
+import multiprocessing as mp
+from multiprocessing.connection import wait as mp_wait
+from contextlib import contextmanager
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 
-import pdfplumber
-import pandas as pd
-from tqdm import tqdm
-from openpyxl.utils import get_column_letter
+class _LazyModule:
+    """Módulo importado no primeiro uso; depois disso o nome global passa a ser o
+    próprio módulo. pandas/pyarrow/pdfplumber somam ~0,7 s de import que um ciclo
+    sem nada novo (ou um `import pdf27` em teste/benchmark) não precisa pagar."""
+    def __init__(self, alias: str, name: str):
+        self._alias, self._name = alias, name
+
+    def __getattr__(self, attr):
+        mod = importlib.import_module(self._name)
+        globals()[self._alias] = mod
+        return getattr(mod, attr)
+
+pdfplumber = _LazyModule("pdfplumber", "pdfplumber")
+np = _LazyModule("np", "numpy")
+pd = _LazyModule("pd", "pandas")
+pa = _LazyModule("pa", "pyarrow")
+pc = _LazyModule("pc", "pyarrow.compute")
+ds = _LazyModule("ds", "pyarrow.dataset")
+pq = _LazyModule("pq", "pyarrow.parquet")
+
+from ofertas_index import FileIndex, FileState, file_hashes
+from text_cache import content_sha1, default_cache
+from metrics import Metrics, call_profiled
 
 # ── CONFIGS ───────────────────────────────────────────────────────────────────
 ROOT = Path(".")
 PDF_DIR        = str(ROOT / "inbox")   # onde os PDFs baixam
 OUT_DIR        = ROOT / "out"
-OUT_DIR.mkdir(parents=True, exist_ok=True)
 
 # Saídas
 MATRIX_XLSX    = str(OUT_DIR / "OFERTASMATRIZ.xlsx")
 PARQUET_INC    = str(OUT_DIR / "OFERTASMATRIZ_OFERTAS.parquet")   # incremento
-PARQUET_ERR    = str(OUT_DIR / "OFERTASMATRIZ_ERROS.parquet")
+PARQUET_ERR    = str(OUT_DIR / "OFERTASMATRIZ_ERROS.parquet")      # erros do ciclo
+ERRORS_OUT     = str(OUT_DIR / "ERROS.parquet")                    # histórico de erros
 MASTER_OUT     = str(OUT_DIR / "OFERTAS.parquet")                 # base-mãe atualizada aqui
 
-# Base-mãe já versionada (prioriza raiz)
+# Layout da base-mãe: "dataset" (padrão) = dataset hive particionado em out/OFERTAS/,
+# que só ganha arquivos novos nas partições tocadas (custo do tamanho do lote);
+# "file" = OFERTAS.parquet único, reescrito inteiro a cada ciclo com linhas novas
+MASTER_LAYOUT  = os.environ.get("MASTER_LAYOUT", "dataset").strip().lower()
+MASTER_DATASET = str(OUT_DIR / "OFERTAS")
+PARTITION_COLS = [c.strip() for c in os.environ.get("MASTER_PARTITIONS", "MES_BUSCA").split(",") if c.strip()]
+MONTH_COL      = "MES_BUSCA"                                       # AAAA-MM de "Data/Hora da Busca"
+COMPACT_FILES  = int(os.environ.get("MASTER_COMPACT_FILES", "32"))  # arquivos por partição que disparam a compactação
+
+# Base-mãe: a cópia de trabalho em out/ vem primeiro, porque já tem a versionada
+# mais tudo o que foi acrescentado depois; a versionada (raiz, data/) só é a fonte
+# enquanto out/OFERTAS.parquet não existe.
 MASTER_CANDIDATES = [
+    Path(MASTER_OUT),
     Path("OFERTAS.parquet"),
     Path("data/OFERTAS.parquet"),
-    Path("out/OFERTAS.parquet"),
 ]
 
 SHEET_OFERTAS  = "OFERTAS"
 SHEET_ERROS    = "ERRO_MONITORAMENTO"
 
-STATE_JSON     = str(OUT_DIR / "OFERTASMATRIZ_STATE.json")
+STATE_JSON     = str(OUT_DIR / "OFERTASMATRIZ_STATE.json")     # legado: migrado para o SQLite
+COMMIT_EVERY   = int(os.environ.get("PDF27_COMMIT_EVERY", "100"))  # PDFs por merge dentro do ciclo
 LOOP_INTERVAL_SEC = 10 * 60
+DEBOUNCE_SEC   = float(os.environ.get("PDF27_DEBOUNCE_SEC", "2"))   # modo --watch
+
+# Pool de processos (1 = serial, como antes)
+WORKERS        = int(os.environ.get("PDF27_WORKERS", "1"))
+FILE_TIMEOUT_SEC = float(os.environ.get("PDF27_FILE_TIMEOUT_SEC", "120"))
+# 1 = extrai ofertas mesmo de PDFs com erro na 1ª página (comportamento antigo)
+OFFERS_ON_ERROR_PAGES = os.environ.get("PDF27_OFFERS_ON_ERROR_PAGES", "0") in ("1", "true", "yes")
+
+# cache de texto por página (PDF27_TEXT_CACHE=diretório, vazio desliga; PDF27_TEXT_CACHE_MB)
+TEXT_CACHE = default_cache()
+
+# tempos por estágio/arquivo (METRICS_JSONL, METRICS_PROM_DIR, PDF27_PROFILE_SLOWEST)
+METRICS = Metrics("pdf27")
 # ──────────────────────────────────────────────────────────────────────────────
 
 logging.getLogger("pdfminer").setLevel(logging.ERROR)
@@ -51,6 +101,49 @@ AIRLINES = ["gol","latam","azul","voepass","jetsmart","airfrance","unitedairline
 
 dates_regex   = re.compile(r"(\d{2}/\d{2}/\d{4},\s*\d{2}:\d{2})")
 price_regex   = re.compile(r"R\$\s*([\d\s\.,]+)")
+
+def _trie_regex(words) -> str:
+    """Alternância em forma de trie (prefixos comuns fatorados). Na posição mais à
+    esquerda o casamento é sempre o mais longo, independente da ordem das palavras."""
+    trie = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def emit(node) -> str:
+        alts = [re.escape(ch) + emit(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        return f"(?:{body})?" if "" in node else body
+    return emit(trie)
+
+# Procurado na linha em minúsculas e sem espaços (mesma normalização de antes).
+# O lookahead devolve o casamento mais longo em cada posição, inclusive sobrepostos;
+# só valem os que começam e terminam em fronteira de palavra da linha original
+# (o "trip.com" de "mytrip.com" e o "tap" de "oferta primetour" não contam).
+# Vence o mais longo da linha, empate à esquerda.
+ENTITY_BY_KEY = {e.replace(" ", ""): e for e in VALID_ENTITIES}
+_ENTITY_TRIE  = _trie_regex(ENTITY_BY_KEY)
+entity_regex  = re.compile(_ENTITY_TRIE)
+_entity_all   = re.compile(f"(?=({_ENTITY_TRIE}))")
+
+def match_entity(line: str) -> str | None:
+    low = line.lower()
+    norm = "".join(low.split())
+    first = entity_regex.search(norm)       # a maioria das linhas para aqui
+    if not first:
+        return None
+    # posição na linha de cada caractere de `norm`, para checar as fronteiras
+    pos = [i for i, ch in enumerate(low) if not ch.isspace()]
+    def bounded(start: int, end: int) -> bool:
+        a, b = pos[start], pos[end - 1]
+        return (a == 0 or not low[a - 1].isalnum()) and (b + 1 == len(low) or not low[b + 1].isalnum())
+    found = [m.group(1) for m in _entity_all.finditer(norm, first.start())
+             if bounded(m.start(), m.start() + len(m.group(1)))]
+    return ENTITY_BY_KEY[max(found, key=len)] if found else None
 CUTOFF_OFFERS = "complemente sua viagem"
 TIMES_CUTOFF  = "verificando preços e disponibilidade"
 FIRST_PAGE_ERROR_RULES = {
@@ -72,17 +165,86 @@ OF_ID_COLS = [
     "Tipo de Voo","Data do Voo","Data/Hora da Busca","Agência/Companhia",
     "Preço","TRECHO","ADVP"
 ]
+# Id (sha1 de OF_ID_COLS canônicas) persistido na base-mãe: o merge compara só
+# os ids do incremento com esta coluna, sem recalcular o histórico.
+ROW_ID_COL = "ID Oferta"
+# Erros não têm chave natural (o mesmo PDF pode falhar em dois ciclos): o id é o
+# do lote em que a linha foi gravada mais a posição, e só evita que o mesmo lote
+# entre duas vezes no histórico.
+ERR_ID_COL = "ID Erro"
+MERGE_BATCH_ROWS = 200_000
+
+# ── Schema da base-mãe ────────────────────────────────────────────────────────
+# Tipos declarados das colunas conhecidas, aplicados em toda leitura e gravação:
+# texto repetido vira dicionário, datas são date32 e números o menor tipo que cabe.
+# Colunas fora da lista (ERROS, extras) mantêm o tipo que tiverem.
+@lru_cache(maxsize=None)
+def _master_types() -> dict:
+    dict_str = pa.dictionary(pa.int32(), pa.string())
+    return {
+        "Nome do Arquivo":    dict_str,
+        "Companhia Aérea":    dict_str,
+        "Tipo de Voo":        dict_str,
+        "Agência/Companhia":  dict_str,
+        "TRECHO":             dict_str,
+        "Data do Voo":        pa.date32(),
+        "Data/Hora da Busca": pa.date32(),
+        "Preço":              pa.decimal128(12, 2),     # centavos exatos (float32 erra acima de ~100 mil)
+        "ADVP":               pa.int16(),
+        "Ranking":            pa.int16(),
+        ROW_ID_COL:           pa.string(),
+    }
+_HORARIO_COL = re.compile(r"Horário\d+$")          # Horário1..N, quantos o PDF tiver (dicionário)
+PARQUET_COMPRESSION = os.environ.get("PDF27_PARQUET_COMPRESSION", "zstd")
+
+def _typed_schema(schema: pa.Schema) -> pa.Schema:
+    types, fields = _master_types(), []
+    for f in schema:
+        t = types.get(f.name) or (pa.dictionary(pa.int32(), pa.string()) if _HORARIO_COL.match(f.name) else f.type)
+        fields.append(pa.field(f.name, t))
+    return pa.schema(fields)
+
+def _typed_table(table: pa.Table) -> pa.Table:
+    return _conform_table(table, _typed_schema(table.schema))
+
+def _df_to_table(df: pd.DataFrame) -> pa.Table:
+    return _typed_table(pa.Table.from_pandas(_to_datetime_cols(df), preserve_index=False))
+
+def _table_to_df(table: pa.Table) -> pd.DataFrame:
+    # dicionários viram Categorical; date32 volta como datetime64, como antes;
+    # decimal (Preço) vira float64 para as contas do pandas e volta exato ao gravar
+    for i, f in enumerate(table.schema):
+        if pa.types.is_decimal(f.type):
+            table = table.set_column(i, f.name, table.column(i).cast(pa.float64()))
+    return table.to_pandas(date_as_object=False)
+
+def _write_parquet(df: pd.DataFrame, path: str):
+    pq.write_table(_df_to_table(df), path, compression=PARQUET_COMPRESSION)
 
 def to_upper_df(df: pd.DataFrame) -> pd.DataFrame:
+    """Caixa alta em toda célula string; demais valores ficam como estão."""
     if df is None or df.empty: return df
-    return df.applymap(lambda x: x.upper() if isinstance(x, str) else x)
+    out = df.copy()
+    for col in out.columns:
+        s = out[col]
+        if not (s.dtype == object or pd.api.types.is_string_dtype(s.dtype)):
+            continue
+        try:
+            up = s.str.upper()          # não-strings viram NaN aqui...
+        except AttributeError:
+            continue                    # coluna object sem nenhuma string
+        out[col] = up.where(up.notna(), s)   # ...e voltam ao valor original
+    return out
 
 def _fmt_date_series_ddmmyyyy(s: pd.Series) -> pd.Series:
     return pd.to_datetime(s, dayfirst=True, errors="coerce").dt.strftime("%d/%m/%Y").fillna("")
 
 def _fmt_price_series_str(s: pd.Series) -> pd.Series:
     s2 = pd.to_numeric(s, errors="coerce").round(2)
-    return s2.map(lambda x: f"{x:.2f}" if pd.notna(x) else "").astype(str)
+    out = pd.Series("", index=s.index, dtype=object)
+    ok = s2.notna().to_numpy()
+    out[ok] = np.char.mod("%.2f", s2[ok].to_numpy(dtype=float))
+    return out.astype(str)
 
 def _canon_ofertas(df: pd.DataFrame) -> pd.DataFrame:
     if df is None or df.empty: 
@@ -103,37 +265,124 @@ def _canon_ofertas(df: pd.DataFrame) -> pd.DataFrame:
     return c[OF_ID_COLS]
 
 def _hash_concat(df: pd.DataFrame, cols: list) -> pd.Series:
-    s = df[cols[0]].astype(str)
-    for col in cols[1:]:
-        s = s.str.cat(df[col].astype(str), sep="||")
-    return s.map(lambda t: hashlib.sha1(t.encode("utf-8")).hexdigest())
+    # concatenação colunar no pyarrow; só o sha1 fica num laço (sem lambda por linha)
+    parts = [pa.array(df[col].astype(str).to_numpy(dtype=object), type=pa.string()) for col in cols]
+    joined = pc.binary_join_element_wise(*parts, "||").to_pylist() if len(df) else []
+    sha1 = hashlib.sha1
+    return pd.Series([sha1(t.encode("utf-8")).hexdigest() for t in joined],
+                     index=df.index, dtype=object, name=cols[0])
 
 def build_row_ids(df: pd.DataFrame) -> pd.Series:
     base = _canon_ofertas(df)
     return _hash_concat(base, OF_ID_COLS)
 
-# ── Estado simples (evitar reprocessar PDF igual) ─────────────────────────────
-def load_state() -> dict:
-    try:
-        with open(STATE_JSON, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
+def _with_error_ids(df: pd.DataFrame) -> pd.DataFrame:
+    out = df.copy()
+    tag = uuid.uuid4().hex
+    out[ERR_ID_COL] = [f"{tag}-{i}" for i in range(len(out))]
+    return out
 
-def save_state(state: dict):
-    try:
-        os.makedirs(os.path.dirname(STATE_JSON), exist_ok=True)
-        with open(STATE_JSON, "w", encoding="utf-8") as f:
-            json.dump(state, f, ensure_ascii=False, indent=2)
-    except Exception:
-        pass
+# ── Estado simples (evitar reprocessar PDF igual) ─────────────────────────────
+# Estado por arquivo no SQLite do índice (FileState); o JSON antigo é migrado uma vez.
+def _state_key(p: str) -> str:
+    return os.path.relpath(os.path.abspath(p), os.path.abspath(PDF_DIR))
+
+def open_state() -> FileState:
+    state = FileState()
+    if os.path.exists(STATE_JSON):
+        n = state.import_json(STATE_JSON, key=_state_key)
+        os.replace(STATE_JSON, STATE_JSON + ".migrado")
+        print(f"[{datetime.now():%H:%M:%S}] Estado migrado de {STATE_JSON}: {n} arquivo(s).")
+    return state
 
 # ── Extração PDF ──────────────────────────────────────────────────────────────
-def first_page_error_code(pdf_path):
+class PdfDoc:
+    """PDF aberto uma única vez; o texto de cada página é extraído sob demanda e
+    reaproveitado por todas as funções de extração. Com o cache de texto ligado,
+    páginas já vistas (mesmo sha1) nem chegam a abrir o PDF. Com `data` o PDF é
+    lido desses bytes (download em memória) e `pdf_path` serve só de nome."""
+
+    def __init__(self, pdf_path, cache=None, sha1=None, data=None):
+        self.path = pdf_path
+        self._data = data
+        self._pdf = None
+        self._texts = {}
+        self._n_pages = None
+        self._cache = TEXT_CACHE if cache is None else cache
+        self._sha1 = sha1
+        self._fresh = False                     # páginas extraídas agora, ainda fora do cache
+        self.t_open = self.t_extract = 0.0      # segundos gastos no pdfplumber (métricas)
+        self.pages_extracted = 0
+        if self._cache:
+            self._sha1 = self._sha1 or (hashlib.sha1(data).hexdigest() if data is not None
+                                        else content_sha1(pdf_path))
+            hit = self._cache.get(self._sha1)
+            if hit:
+                self._n_pages, self._texts = hit
+
+    def _open(self):
+        if self._pdf is None:
+            t0 = time.perf_counter()
+            self._pdf = pdfplumber.open(io.BytesIO(self._data) if self._data is not None else self.path)
+            self.t_open += time.perf_counter() - t0
+        return self._pdf
+
+    @property
+    def n_pages(self) -> int:
+        if self._n_pages is None:
+            self._n_pages = len(self._open().pages)
+            self._fresh = True
+        return self._n_pages
+
+    def page_text(self, i: int) -> str:
+        if i not in self._texts:
+            page = self._open().pages[i]
+            t0 = time.perf_counter()
+            self._texts[i] = page.extract_text() or ""
+            self.t_extract += time.perf_counter() - t0
+            self.pages_extracted += 1
+            self._fresh = True
+        return self._texts[i]
+
+    def text_until(self, marker: str) -> str:
+        """Texto das páginas, uma por linha, até a primeira que contém `marker`
+        (em minúsculas): as páginas seguintes nem são extraídas."""
+        parts = []
+        for i in range(self.n_pages):
+            text = self.page_text(i)
+            parts.append(text + "\n")
+            if marker in text.lower():
+                break
+        return "".join(parts)
+
+    def close(self):
+        if self._fresh and self._cache:
+            self._cache.put(self._sha1, self.n_pages, self._texts)
+            self._fresh = False
+        if self._pdf is not None:
+            self._pdf.close()
+            self._pdf = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+@contextmanager
+def _as_doc(src):
+    """Aceita um caminho ou um PdfDoc já aberto (que não é fechado aqui)."""
+    if isinstance(src, PdfDoc):
+        yield src
+    else:
+        with PdfDoc(src) as doc:
+            yield doc
+
+def first_page_error_code(src):
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            if not pdf.pages: return None, None
-            text = (pdf.pages[0].extract_text() or "")
+        with _as_doc(src) as doc:
+            if not doc.n_pages: return None, None
+            text = doc.page_text(0)
     except Exception:
         return None, None
     low = text.lower()
@@ -145,9 +394,9 @@ def first_page_error_code(pdf_path):
             return code, trecho
     return None, None
 
-def extract_flight_info(pdf_path):
-    with pdfplumber.open(pdf_path) as pdf:
-        text = pdf.pages[0].extract_text() or ""
+def extract_flight_info(src):
+    with _as_doc(src) as doc:
+        text = doc.page_text(0)
     low = text.lower()
 
     for pat, err in PAGE_ERROR_PATTERNS.items():
@@ -183,11 +432,10 @@ def extract_flight_info(pdf_path):
 
     return {"Companhia Aérea": cia, **times_dict, "Tipo de Voo": tipo, "Data do Voo": flight_date}, None
 
-def extract_offers_from_pdf(pdf_path, search_dt):
-    text = ""
-    with pdfplumber.open(pdf_path) as pdf:
-        for p in pdf.pages:
-            text += (p.extract_text() or "") + "\n"
+def extract_offers_from_pdf(src, search_dt):
+    # tudo depois do CUTOFF_OFFERS é descartado abaixo; não vale extrair essas páginas
+    with _as_doc(src) as doc:
+        text = doc.text_until(CUTOFF_OFFERS)
 
     text = re.sub(r"(\d)\n(\d)", r"\1\2", text)
     lines = [l.strip() for l in text.splitlines() if l.strip()]
@@ -201,10 +449,9 @@ def extract_offers_from_pdf(pdf_path, search_dt):
 
     offers, last_ent = [], None
     for l in lines:
-        norm = re.sub(r"\s+","", l.lower())
-        for ent in VALID_ENTITIES:
-            if ent.replace(" ","") in norm:
-                last_ent = ent; break
+        ent = match_entity(l)
+        if ent:
+            last_ent = ent
         pm = price_regex.search(l)
         if pm and last_ent:
             raw = pm.group(1)
@@ -223,24 +470,243 @@ def rank_prices(df):
     df['Ranking'] = df.groupby('Nome do Arquivo')['Preço'].rank(method='min', ascending=True).astype(int)
     return df
 
-def todas_colunas_preenchidas(row, cols_req):
-    return all(pd.notna(row.get(col)) and str(row.get(col)).strip() != "" for col in cols_req)
+def todas_colunas_preenchidas(df: pd.DataFrame, cols_req) -> pd.Series:
+    """Máscara das linhas com todas as `cols_req` presentes, não nulas e não vazias."""
+    mask = pd.Series(True, index=df.index)
+    for col in cols_req:
+        if col not in df:
+            return pd.Series(False, index=df.index)
+        s = df[col]
+        mask &= s.notna() & (s.astype(str).str.strip() != "")
+    return mask
+
+# ── Processamento por arquivo ─────────────────────────────────────────────────
+def process_pdf(path, sha1=None, timings=None, data=None):
+    """Extrai um PDF e devolve (linhas de ofertas, linhas de erros). Com `sha1`
+    o texto pode vir só do cache, mesmo que o arquivo não exista mais; com `data`
+    o PDF vem desses bytes e não do disco.
+    `timings` (dict), se dado, recebe os tempos de abertura/extração/regex."""
+    fn = os.path.basename(path)
+    t0 = time.perf_counter()
+    doc = PdfDoc(path, sha1=sha1, data=data)
+    try:
+        offers_rows, errors_rows = _process_doc(doc, fn)
+    finally:
+        doc.close()
+        if timings is not None:
+            total = time.perf_counter() - t0
+            timings.update(
+                bytes=len(data) if data is not None else os.path.getsize(path) if os.path.exists(path) else None,
+                pages=doc._n_pages, pages_extracted=doc.pages_extracted,
+                open=round(doc.t_open, 4), extract=round(doc.t_extract, 4),
+                regex=round(max(0.0, total - doc.t_open - doc.t_extract), 4), total=round(total, 4),
+            )
+    return offers_rows, errors_rows
+
+def _process_doc(doc: PdfDoc, fn: str):
+    offers_rows, errors_rows = [], []
+    code, trecho = first_page_error_code(doc)
+    if code:
+        errors_rows.append({"Nome do Arquivo": fn, "Erro": code, "Trecho": trecho, "Pagina": 1})
+
+    flight_info, err = extract_flight_info(doc)
+    if err:
+        errors_rows.append({"Nome do Arquivo": fn, "Erro": err, "Trecho": "", "Pagina": 1})
+
+    # Página de erro: só a primeira página é lida. Sem flight_info as linhas cairiam
+    # no filtro de colunas obrigatórias de qualquer jeito; com código da 1ª página
+    # (home, antibot...) os preços não são ofertas da busca.
+    if err or (code and not OFFERS_ON_ERROR_PAGES):
+        return offers_rows, errors_rows
+    offers, sdt = extract_offers_from_pdf(doc, "")
+    for o in offers:
+        offers_rows.append({
+            "Nome do Arquivo": fn,
+            **(flight_info or {}),
+            "Data/Hora da Busca": sdt,
+            **o,
+            "TRECHO": get_trecho(fn)
+        })
+    return offers_rows, errors_rows
+
+def _failure_rows(path, code, detail):
+    return [], [{"Nome do Arquivo": os.path.basename(path), "Erro": code, "Trecho": detail[:200], "Pagina": 0}]
+
+def is_failure(errors_rows) -> bool:
+    """Resultado de _failure_rows (timeout, worker, exceção), não do conteúdo do PDF."""
+    return any(e.get("Pagina") == 0 for e in errors_rows)
+
+def _record_file(path, status: str, result=None, timings=None):
+    METRICS.file(path, status=status, rows=len(result[0]) if result else 0, **(timings or {}))
+
+def process_pdf_recorded(path, sha1=None):
+    """process_pdf com tempos registrados em METRICS (e cProfile, se ligado)."""
+    timings = {}
+    try:
+        result = call_profiled(path, process_pdf, path, sha1, timings)
+    except Exception:
+        _record_file(path, "erro", timings=timings)
+        raise
+    _record_file(path, "ok", result, timings)
+    return result
 
-# ── Excel/Parquet ─────────────────────────────────────────────────────────────
-def write_back_preserving(file_path, df_ofertas, df_erros):
-    mode = "a" if os.path.exists(file_path) else "w"
-    with pd.ExcelWriter(file_path, engine="openpyxl", mode=mode, if_sheet_exists=("replace" if mode=="a" else None)) as writer:
-        df_ofertas.to_excel(writer, index=False, sheet_name=SHEET_OFERTAS)
-        df_erros.to_excel(writer, index=False, sheet_name=SHEET_ERROS)
-        ws = writer.sheets[SHEET_OFERTAS]
-        cols = list(df_ofertas.columns)
-        for col_name in ["Data do Voo","Data/Hora da Busca"]:
-            if col_name in cols:
-                idx = cols.index(col_name) + 1
-                letter = get_column_letter(idx)
-                for cell in ws[letter][1:]:
-                    cell.number_format = "DD/MM/YYYY"
+def _worker_loop(conn):
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        key, path, sha1, data = task
+        timings = {}
+        try:
+            conn.send((key, "ok", call_profiled(path, process_pdf, path, sha1, timings, data), timings))
+        except Exception as e:
+            conn.send((key, "erro", f"{type(e).__name__}: {e}", timings))
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child = ctx.Pipe()
+        self.proc = ctx.Process(target=_worker_loop, args=(child,), daemon=True)
+        self.proc.start()
+        child.close()
+        self.task = None
+        self.started = 0.0
+
+    def kill(self):
+        self.proc.kill()
+        self.proc.join()
+        self.conn.close()
+
+class PdfWorkerPool:
+    """Pool de processos para process_pdf com timeout por arquivo e isolamento:
+    um PDF que trava ou derruba o worker vira uma linha de erro, o worker é
+    substituído e o restante do lote segue normalmente."""
+
+    def __init__(self, workers: int, timeout: float = FILE_TIMEOUT_SEC, start_method: str | None = None):
+        # fork é o mais barato, mas só é seguro sem outras threads no processo: o
+        # filho herdaria travas (ssl, logging...) seguras por elas. Quem cria ou
+        # substitui workers com threads rodando (pipeline) pede "forkserver": os
+        # workers nascem de um servidor limpo, com o pdf27 já importado.
+        methods = mp.get_all_start_methods()
+        if start_method and start_method not in methods:
+            start_method = "spawn"
+        start_method = start_method or ("fork" if "fork" in methods else "spawn")
+        self._ctx = mp.get_context(start_method)
+        if start_method == "forkserver" and __name__ != "__main__":
+            self._ctx.set_forkserver_preload([__name__])
+        self.timeout = timeout
+        self._workers = [_Worker(self._ctx) for _ in range(max(1, workers))]
+        self._queue = []
+
+    @property
+    def pending(self) -> int:
+        return len(self._queue) + sum(1 for w in self._workers if w.task is not None)
+
+    def submit(self, key, path, sha1=None, data=None):
+        self._queue.append((key, path, sha1, data))
+
+    def _dispatch(self):
+        for w in self._workers:
+            if w.task is None and self._queue:
+                w.task = self._queue.pop(0)
+                w.started = time.monotonic()
+                w.conn.send(w.task)
+
+    def _replace(self, w):
+        w.kill()
+        self._workers[self._workers.index(w)] = _Worker(self._ctx)
+
+    def poll(self, wait: float | None = None) -> list:
+        """Despacha tarefas e devolve as concluídas: [(key, path, offers_rows, errors_rows)]."""
+        self._dispatch()
+        busy = [w for w in self._workers if w.task is not None]
+        if not busy:
+            return []
+        now = time.monotonic()
+        limit = min(w.started + self.timeout for w in busy) - now if self.timeout > 0 else None
+        if wait is not None:
+            limit = wait if limit is None else min(limit, wait)
+        ready = set(mp_wait([w.conn for w in busy] + [w.proc.sentinel for w in busy],
+                            timeout=None if limit is None else max(0.0, limit)))
+
+        done = []
+        for w in busy:
+            key, path = w.task[:2]
+            if w.conn in ready:
+                timings = {}
+                try:
+                    _, status, payload, timings = w.conn.recv()
+                except (EOFError, OSError):
+                    status, payload = "crash", f"worker terminou (exitcode={w.proc.exitcode})"
+                    self._replace(w)
+                if status == "ok":
+                    done.append((key, path, *payload))
+                    _record_file(path, "ok", payload, timings)
+                else:
+                    code = "ERRO PROCESSAMENTO" if status == "erro" else "ERRO WORKER"
+                    done.append((key, path, *_failure_rows(path, code, payload)))
+                    _record_file(path, code, timings=timings or {"total": round(time.monotonic() - w.started, 4)})
+                w.task = None
+            elif w.proc.sentinel in ready:
+                self._replace(w)
+                done.append((key, path, *_failure_rows(path, "ERRO WORKER",
+                                                       "worker terminou durante o processamento")))
+                _record_file(path, "ERRO WORKER", timings={"total": round(time.monotonic() - w.started, 4)})
+            elif self.timeout > 0 and time.monotonic() - w.started >= self.timeout:
+                self._replace(w)
+                done.append((key, path, *_failure_rows(path, "ERRO TIMEOUT",
+                                                       f"excedeu {self.timeout:.0f}s")))
+                _record_file(path, "ERRO TIMEOUT", timings={"total": round(time.monotonic() - w.started, 4)})
+        self._dispatch()
+        return done
+
+    def close(self):
+        for w in self._workers:
+            if w.task is None and w.proc.is_alive():
+                try:
+                    w.conn.send(None)
+                except OSError:
+                    pass
+                w.proc.join(timeout=1)
+            if w.proc.is_alive():
+                w.proc.kill()
+            w.proc.join()
+            w.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def iter_processed(paths, workers: int, timeout: float = FILE_TIMEOUT_SEC, sha1s=None):
+    """Gera (posição, caminho, (linhas de ofertas, linhas de erros)) à medida que
+    cada PDF termina: em ordem no modo serial, por ordem de conclusão no pool."""
+    sha1s = sha1s or [None] * len(paths)
+    if workers <= 1:
+        for i, (p, h) in enumerate(zip(paths, sha1s)):
+            yield i, p, process_pdf_recorded(p, h)
+        return
+    with PdfWorkerPool(workers, timeout) as pool:
+        for i, (p, h) in enumerate(zip(paths, sha1s)):
+            pool.submit(i, p, h)
+        while pool.pending:
+            for key, path, of_rows, er_rows in pool.poll():
+                yield key, path, (of_rows, er_rows)
+
+def process_pdfs_parallel(paths, workers: int, timeout: float = FILE_TIMEOUT_SEC, sha1s=None) -> list:
+    """Processa `paths` no pool e devolve os resultados na mesma ordem de entrada."""
+    results = {}
+    from tqdm import tqdm
+    with tqdm(total=len(paths), desc=f"Processando PDFs ({workers} workers)") as bar:
+        for i, _, res in iter_processed(paths, workers, timeout, sha1s):
+            results[i] = res
+            bar.update(1)
+    return [results[i] for i in range(len(paths))]
 
+# ── Excel/Parquet ─────────────────────────────────────────────────────────────
 def _to_datetime_cols(df: pd.DataFrame) -> pd.DataFrame:
     out = df.copy()
     for c in ["Data do Voo","Data/Hora da Busca"]:
@@ -248,37 +714,93 @@ def _to_datetime_cols(df: pd.DataFrame) -> pd.DataFrame:
             out[c] = pd.to_datetime(out[c], errors="coerce")
     return out
 
-def _load_master_df() -> pd.DataFrame:
+def _master_source() -> Path | None:
+    return next((p for p in MASTER_CANDIDATES if p.exists()), None)
+
+def _load_master_df(filter=None, columns=None) -> pd.DataFrame:
+    """Base-mãe inteira (ou filtrada/projetada). No layout "dataset" o filtro é
+    empurrado para a leitura (partições e row groups que não batem nem são lidos)."""
+    if MASTER_LAYOUT == "dataset" and _dataset_exists():
+        return _load_master_dataset_df(filter=filter, columns=columns)
     for p in MASTER_CANDIDATES:
         if p.exists():
             try:
-                return pd.read_parquet(p)
+                return _table_to_df(_typed_table(ds.dataset(p, format="parquet").to_table(columns=columns, filter=filter)))
             except Exception:
                 pass
     return pd.DataFrame()
 
 def _save_master_out(df: pd.DataFrame):
-    df2 = _to_datetime_cols(df)
-    df2.to_parquet(MASTER_OUT, index=False)
-
-def _dedup_by_id(df: pd.DataFrame) -> pd.DataFrame:
-    if df.empty:
-        return df
-    tmp = df.copy()
-    tmp["__id__"] = build_row_ids(tmp)
-    tmp = tmp.drop_duplicates("__id__", keep="last").drop(columns="__id__")
-    return tmp
+    _write_parquet(df, MASTER_OUT + ".tmp")
+    os.replace(MASTER_OUT + ".tmp", MASTER_OUT)
+
+def _ensure_master_out():
+    """Garante a base-mãe em MASTER_OUT sem reescrevê-la (cópia simples da versionada na primeira vez)."""
+    if MASTER_LAYOUT == "dataset" or os.path.exists(MASTER_OUT):
+        return
+    src = _master_source()
+    if src is not None:
+        shutil.copy2(src, MASTER_OUT)
+
+def _with_row_ids(df: pd.DataFrame) -> pd.DataFrame:
+    out = df.copy()
+    out[ROW_ID_COL] = build_row_ids(out) if not out.empty else pd.Series(dtype=str)
+    return out.drop_duplicates(ROW_ID_COL, keep="last")
 
-def export_increment_and_update_master(increment_df: pd.DataFrame):
-    # Salva incremento
-    inc = increment_df.copy()
-    if not inc.empty:
-        _to_datetime_cols(inc).to_parquet(PARQUET_INC, index=False)
-    else:
-        pd.DataFrame(columns=OF_ID_COLS).to_parquet(PARQUET_INC, index=False)
+def _sort_master(df: pd.DataFrame) -> pd.DataFrame:
+    if "Data/Hora da Busca" in df:
+        return df.sort_values(by=["Data/Hora da Busca","Preço"], ascending=[False, True], ignore_index=True)
+    return df
 
-    # Merge com base-mãe e dedupe
-    master = _load_master_df()
+def _conform_table(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    cols = []
+    for field in schema:
+        if field.name in table.column_names:
+            cols.append(table.column(field.name).cast(field.type, safe=False))
+        else:
+            cols.append(pa.nulls(table.num_rows, field.type))
+    return pa.Table.from_arrays(cols, schema=schema)
+
+def _name_mask(table: pa.Table, names: pa.Array) -> pa.ChunkedArray:
+    """Linhas cujo "Nome do Arquivo" (em caixa alta) está em `names`."""
+    if "Nome do Arquivo" not in table.column_names:
+        return pa.chunked_array([pa.array([False] * table.num_rows)])
+    col = pc.utf8_upper(table.column("Nome do Arquivo").cast(pa.string()))
+    return pc.fill_null(pc.is_in(col, value_set=names), False)
+
+def _append_parquet(src, dest: str, new_rows, drop_names=None):
+    """Copia `src` em lotes para `dest` e acrescenta `new_rows` no fim.
+    Memória limitada a MERGE_BATCH_ROWS linhas, sem pandas sobre o histórico.
+    Com `drop_names`, as linhas desses arquivos ficam de fora da cópia (substituição).
+    `new_rows` pode ser um DataFrame ou uma pa.Table.
+    Devolve (linhas removidas, linhas acrescentadas), ambas já no schema gravado."""
+    new_table = _typed_table(new_rows) if isinstance(new_rows, pa.Table) else _df_to_table(new_rows)
+    if src is None or not os.path.exists(src):
+        pq.write_table(new_table, dest + ".tmp", compression=PARQUET_COMPRESSION)
+        os.replace(dest + ".tmp", dest)
+        return new_table.slice(0, 0), new_table
+    pf = pq.ParquetFile(src)
+    schema = pa.unify_schemas([_typed_schema(pf.schema_arrow), new_table.schema],
+                              promote_options="permissive").remove_metadata()
+    names = pa.array(sorted(drop_names or []), type=pa.string())
+    new_table = _conform_table(new_table, schema)
+    removed = []
+    tmp = dest + ".tmp"
+    with pq.ParquetWriter(tmp, schema, compression=PARQUET_COMPRESSION) as writer:
+        for batch in pf.iter_batches(batch_size=MERGE_BATCH_ROWS):
+            table = _conform_table(pa.Table.from_batches([batch]), schema)
+            if len(names):
+                hit = _name_mask(table, names)
+                removed.append(table.filter(hit))
+                table = table.filter(pc.invert(hit))
+            writer.write_table(table)
+        writer.write_table(new_table)
+    pf.close()
+    os.replace(tmp, dest)
+    return pa.concat_tables(removed) if removed else new_table.slice(0, 0), new_table
+
+def _rebuild_master(master: pd.DataFrame, inc: pd.DataFrame):
+    """Caminho completo (base-mãe sem ROW_ID_COL): concatena, deduplica e grava já com os ids."""
     all_cols = sorted(set(list(master.columns) + list(inc.columns)))
     if not master.empty:
         for c in all_cols:
@@ -290,74 +812,518 @@ def export_increment_and_update_master(increment_df: pd.DataFrame):
         inc = inc[all_cols]
 
     merged = pd.concat([master, inc], ignore_index=True)
-    merged = _dedup_by_id(merged)
+    merged = _with_row_ids(merged.drop(columns=[ROW_ID_COL], errors="ignore"))
+    _save_master_out(_sort_master(merged))
 
-    if "Data/Hora da Busca" in merged:
-        merged = merged.sort_values(by=["Data/Hora da Busca","Preço"], ascending=[False, True], ignore_index=True)
+# ── Base-mãe particionada (dataset hive) ──────────────────────────────────────
+def _hive_partitioning():
+    return ds.partitioning(pa.schema([(c, pa.string()) for c in PARTITION_COLS]), flavor="hive")
 
-    _save_master_out(merged)
+def _master_dataset(path: str = MASTER_DATASET):
+    """Dataset da base-mãe com o schema unificado de todos os arquivos."""
+    d = ds.dataset(path, format="parquet", partitioning=_hive_partitioning())
+    schemas = [d.schema] + [f.physical_schema for f in d.get_fragments()]
+    schema = pa.unify_schemas([_typed_schema(s) for s in schemas], promote_options="permissive")
+    return ds.dataset(path, format="parquet", partitioning=_hive_partitioning(), schema=schema)
+
+def _dataset_exists(path: str = MASTER_DATASET) -> bool:
+    return os.path.isdir(path) and any(Path(path).rglob("*.parquet"))
+
+def _with_partition_cols(df: pd.DataFrame) -> pd.DataFrame:
+    out = df.copy()
+    if MONTH_COL in PARTITION_COLS:
+        out[MONTH_COL] = pd.to_datetime(out["Data/Hora da Busca"], errors="coerce").dt.strftime("%Y-%m").fillna("SEM_DATA")
+    for c in PARTITION_COLS:
+        if c != MONTH_COL:
+            out[c] = out[c].astype(str).replace({"": "SEM_VALOR", "nan": "SEM_VALOR"})
+    return out
+
+def _load_master_dataset_df(filter=None, columns=None) -> pd.DataFrame:
+    if not _dataset_exists():
+        return pd.DataFrame()
+    table = _master_dataset().to_table(filter=filter, columns=columns)
+    df = _table_to_df(table)
+    if ROW_ID_COL in df:
+        df = df.drop_duplicates(ROW_ID_COL, keep="last", ignore_index=True)
+    return df
+
+def _write_partitions(df: pd.DataFrame, tag: str):
+    # o uuid torna o nome único: com "overwrite_or_ignore", dois lotes com o mesmo
+    # tag (mesmo processo, mesmo segundo) sobrescreveriam os arquivos um do outro
+    ds.write_dataset(
+        _df_to_table(df), MASTER_DATASET, format="parquet",
+        partitioning=_hive_partitioning(),
+        file_options=ds.ParquetFileFormat().make_write_options(compression=PARQUET_COMPRESSION),
+        basename_template=f"part-{tag}-{uuid.uuid4().hex}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+def _append_to_dataset(inc: pd.DataFrame):
+    """Acrescenta ao dataset só as linhas novas. Ids iguais implicam a mesma data de
+    busca (e o mesmo TRECHO), então basta ler os ids das partições tocadas."""
+    if not _dataset_exists():
+        src = _master_source()
+        if src is not None:
+            print(f"[{datetime.now():%H:%M:%S}] Convertendo {src} para dataset particionado em {MASTER_DATASET}.")
+            master = _load_master_df()
+            if ROW_ID_COL not in master:
+                master = _with_row_ids(master)
+            _write_partitions(_with_partition_cols(master), "base")
+    if inc.empty:
+        return
+    inc = _with_partition_cols(inc)
+    if _dataset_exists():
+        touched = inc[PARTITION_COLS].drop_duplicates()
+        flt = None
+        for c in PARTITION_COLS:
+            cond = pc.field(c).isin(touched[c].unique().tolist())
+            flt = cond if flt is None else flt & cond
+        known = _master_dataset().to_table(columns=[ROW_ID_COL], filter=flt).column(0)
+        is_known = pc.is_in(pa.array(inc[ROW_ID_COL].to_numpy(dtype=object), type=pa.string()),
+                            value_set=known.combine_chunks().cast(pa.string()))
+        inc = inc[~is_known.to_numpy(zero_copy_only=False)]
+    if inc.empty:
+        return
+    _write_partitions(_sort_master(inc), f"{datetime.now():%Y%m%d%H%M%S}-{os.getpid()}")
+    print(f"[{datetime.now():%H:%M:%S}] Dataset: {len(inc)} linha(s) nova(s) em "
+          f"{len(inc[PARTITION_COLS].drop_duplicates())} partição(ões).")
+
+def compact_master_dataset(min_files: int = 2, quiet: bool = False) -> int:
+    """Junta os arquivos de cada partição com >= min_files arquivos num só.
+    Grava o novo arquivo antes de remover os antigos: uma queda no meio deixa
+    linhas duplicadas (removidas na leitura pelo id), nunca perde dados."""
+    if not _dataset_exists():
+        return 0
+    schema = _master_dataset().schema
+    data_cols = [f for f in schema if f.name not in PARTITION_COLS]
+    compacted = 0
+    dirs = {}
+    for f in Path(MASTER_DATASET).rglob("*.parquet"):
+        dirs.setdefault(f.parent, []).append(f)
+    for part_dir, files in sorted(dirs.items()):
+        if len(files) < min_files:
+            continue
+        tables = [_conform_table(pq.read_table(f, partitioning=None), pa.schema(data_cols)) for f in files]
+        table = pa.concat_tables(tables)
+        if ROW_ID_COL in table.column_names:
+            df = table.to_pandas().drop_duplicates(ROW_ID_COL, keep="last")
+            table = pa.Table.from_pandas(df, schema=pa.schema(data_cols), preserve_index=False)
+        tmp = part_dir / "_compact.tmp"
+        pq.write_table(table, tmp, compression=PARQUET_COMPRESSION)
+        final = part_dir / f"part-compact-{datetime.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex}.parquet"
+        os.replace(tmp, final)
+        for f in files:
+            if f != final:
+                f.unlink()
+        compacted += 1
+    if compacted or not quiet:
+        print(f"[{datetime.now():%H:%M:%S}] Compactação: {compacted} partição(ões) reescrita(s).")
+    return compacted
+
+def _replace_in_dataset(names, new_rows: pd.DataFrame):
+    """Troca no dataset as linhas dos arquivos `names` por `new_rows`. As novas são
+    gravadas antes de limpar os arquivos antigos: uma queda no meio deixa linhas
+    duplicadas (descartadas na leitura pelo id), nunca perde dados.
+    Devolve (linhas removidas, linhas acrescentadas) no schema do dataset."""
+    _append_to_dataset(pd.DataFrame())          # converte a base-mãe em arquivo, se for o caso
+    new_table = _df_to_table(new_rows)
+    if not _dataset_exists():
+        if not new_rows.empty:
+            _write_partitions(_with_partition_cols(_sort_master(new_rows)), "reparse")
+        return new_table.slice(0, 0), new_table
+    schema = pa.unify_schemas([_master_dataset().schema, new_table.schema], promote_options="permissive")
+    data_schema = pa.schema([f for f in schema if f.name not in PARTITION_COLS])
+    new_table = _conform_table(new_table, data_schema)
+
+    old_files = list(Path(MASTER_DATASET).rglob("*.parquet"))
+    if not new_rows.empty:
+        _write_partitions(_with_partition_cols(_sort_master(new_rows)),
+                          f"reparse-{datetime.now():%Y%m%d%H%M%S}-{os.getpid()}")
+    names = pa.array(sorted(names), type=pa.string())
+    removed = []
+    for f in old_files:
+        table = pq.read_table(f, partitioning=None)
+        hit = _name_mask(table, names)
+        if not pc.any(hit).as_py():
+            continue
+        removed.append(_conform_table(table.filter(hit), data_schema))
+        rest = table.filter(pc.invert(hit))
+        if rest.num_rows:
+            tmp = f.with_name(f.name + ".tmp")
+            pq.write_table(_typed_table(rest), tmp, compression=PARQUET_COMPRESSION)
+            os.replace(tmp, f)
+        else:
+            f.unlink()
+    return pa.concat_tables(removed) if removed else new_table.slice(0, 0), new_table
+
+# ── Lotes do ciclo ────────────────────────────────────────────────────────────
+# Cada commit_batch grava só as próprias linhas em out/LOTES/ (incremento, erros e,
+# no layout "file", as ofertas novas); base-mãe, histórico de erros e parquets do
+# ciclo são reescritos uma única vez, em flush_batches() no fim do ciclo. Lotes que
+# sobram de uma queda entram no flush seguinte.
+SEGMENTS_DIR = OUT_DIR / "LOTES"
+
+def _segment_files(kind: str) -> list:
+    return sorted(SEGMENTS_DIR.glob(f"{kind}-*.parquet"))       # nome começa pelo instante: ordem de gravação
+
+def _write_segment(kind: str, df: pd.DataFrame):
+    SEGMENTS_DIR.mkdir(parents=True, exist_ok=True)
+    path = str(SEGMENTS_DIR / f"{kind}-{datetime.now():%Y%m%d%H%M%S%f}-{uuid.uuid4().hex[:8]}.parquet")
+    _write_parquet(df, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+def _read_segments(files) -> pa.Table:
+    tables = [_typed_table(pq.read_table(f)) for f in files]
+    schema = pa.unify_schemas([t.schema for t in tables], promote_options="permissive")
+    return pa.concat_tables([_conform_table(t, schema) for t in tables])
+
+def _segment_ids(files) -> pa.Array:
+    ids = [pq.read_table(f, columns=[ROW_ID_COL]).column(0).cast(pa.string()) for f in files]
+    return pa.chunked_array(ids, type=pa.string()).combine_chunks()
+
+_master_ids_cache = {}
+
+def _master_ids(src) -> pa.Array:
+    """Coluna de ids da base-mãe, lida uma vez por ciclo: ela só muda no flush."""
+    st = os.stat(src)
+    key = (str(src), st.st_mtime_ns, st.st_size)
+    if key not in _master_ids_cache:
+        _master_ids_cache.clear()
+        _master_ids_cache[key] = pq.read_table(src, columns=[ROW_ID_COL]).column(0).combine_chunks().cast(pa.string())
+    return _master_ids_cache[key]
+
+def _unknown_mask(ids, known) -> pa.Array:
+    """Máscara dos `ids` ausentes de `known`. A tabela hash é a dos poucos ids do
+    lote; o histórico só é percorrido, sem montar um hash de milhões de ids."""
+    hits = known.filter(pc.is_in(known, value_set=ids))
+    return pc.invert(pc.is_in(ids, value_set=hits))
+
+def export_increment_and_update_master(increment_df: pd.DataFrame):
+    """Grava o incremento de um lote: no layout "dataset" as linhas novas já vão
+    para as partições; no "file", para um lote em out/LOTES/ (ver flush_batches)."""
+    inc = _with_row_ids(increment_df) if not increment_df.empty else pd.DataFrame(columns=OF_ID_COLS + [ROW_ID_COL])
+    _write_segment("INCREMENTO", inc)
+
+    if MASTER_LAYOUT == "dataset":
+        _append_to_dataset(inc)
+        return
+
+    src = _master_source()
+    if src is not None and ROW_ID_COL not in pq.read_schema(src).names:
+        print(f"[{datetime.now():%H:%M:%S}] Base-mãe sem '{ROW_ID_COL}': migrando (única vez).")
+        _rebuild_master(_load_master_df(), inc)
+        return
+    if inc.empty:
+        return
+
+    # Só os ids do incremento são comparados com a coluna de ids da base-mãe e dos lotes do ciclo
+    with METRICS.timer("dedup"):
+        ids = pa.array(inc[ROW_ID_COL].to_numpy(dtype=object), type=pa.string())
+        keep = pa.array([True] * len(inc))
+        if src is not None:
+            keep = _unknown_mask(ids, _master_ids(src))
+        pending = _segment_files("OFERTAS")
+        if pending:
+            keep = pc.and_(keep, _unknown_mask(ids, _segment_ids(pending)))
+        new_rows = inc[keep.to_numpy(zero_copy_only=False)]
+    if not new_rows.empty:
+        _write_segment("OFERTAS", _sort_master(new_rows))
+
+def flush_batches() -> int:
+    """Incorpora os lotes de out/LOTES/: no layout "file", uma reescrita da base-mãe
+    por ciclo, não por lote (no "dataset" as linhas já foram para as partições);
+    uma reescrita do histórico de erros. Grava também os parquets do
+    ciclo (incremento e erros) e atualiza os agregados das linhas acrescentadas.
+    Os lotes só são apagados depois de gravados; ofertas de um flush interrompido
+    não duplicam (os ids já na base-mãe são descartados). Devolve as linhas novas."""
+    inc_files, err_files = _segment_files("INCREMENTO"), _segment_files("ERROS")
+    if inc_files:
+        inc = _read_segments(inc_files)
+        pq.write_table(inc, PARQUET_INC + ".tmp", compression=PARQUET_COMPRESSION)
+        os.replace(PARQUET_INC + ".tmp", PARQUET_INC)
+    if err_files:
+        with METRICS.timer("errors_write"):
+            errs = _read_segments(err_files)
+            pq.write_table(errs, PARQUET_ERR + ".tmp", compression=PARQUET_COMPRESSION)
+            os.replace(PARQUET_ERR + ".tmp", PARQUET_ERR)
+            # um flush interrompido depois desta gravação não repete os erros no próximo
+            if ERR_ID_COL in errs.column_names and os.path.exists(ERRORS_OUT) \
+                    and ERR_ID_COL in pq.read_schema(ERRORS_OUT).names:
+                known = pq.read_table(ERRORS_OUT, columns=[ERR_ID_COL]).column(0).combine_chunks().cast(pa.string())
+                errs = errs.filter(_unknown_mask(errs.column(ERR_ID_COL).cast(pa.string()), known))
+            if errs.num_rows:
+                _append_parquet(ERRORS_OUT, ERRORS_OUT, errs)
+
+    added = 0
+    of_files = _segment_files("OFERTAS") if MASTER_LAYOUT != "dataset" else []
+    if of_files:
+        rows = _read_segments(of_files)
+        src = _master_source()
+        new = rows
+        if src is not None:
+            new = rows.filter(_unknown_mask(rows.column(ROW_ID_COL).cast(pa.string()), _master_ids(src)))
+        elif new.num_rows:
+            new = new.select(sorted(new.column_names))
+        with METRICS.timer("write"):
+            _append_parquet(src, MASTER_OUT, new)
+        _master_ids_cache.clear()
+        added = new.num_rows
+        with METRICS.timer("aggregates"):
+            # todas as linhas dos lotes: se o flush anterior caiu antes dos agregados, refaz aquelas chaves
+            METRICS.count("aggregate_keys", max(0, update_aggregates(_table_to_df(rows))))
+    else:
+        _ensure_master_out()
+    if MASTER_LAYOUT == "dataset" and COMPACT_FILES > 1:
+        # cada lote acrescenta um arquivo por partição tocada; de tempos em tempos a
+        # partição (em geral só a do mês corrente) vira um arquivo só
+        with METRICS.timer("compact"):
+            compact_master_dataset(COMPACT_FILES, quiet=True)
+    for f in inc_files + err_files + of_files:
+        f.unlink()
+    return added
+
+# ── Agregados para publicação ─────────────────────────────────────────────────
+# Tabelas pequenas ao lado da base-mãe, publicadas no Pages: quem só quer "menor
+# preço por trecho/dia" não baixa o histórico. A cada lote só as chaves
+# (TRECHO, dia da busca) tocadas são recalculadas a partir da base-mãe gravada;
+# se faltar algum arquivo (primeiro run, out/ limpo), tudo é reconstruído.
+AGGREGATES   = os.environ.get("PDF27_AGGREGATES", "1") in ("1", "true", "yes")
+AGG_DIR      = OUT_DIR / "AGREGADOS"
+AGG_PRECOS   = str(AGG_DIR / "PRECOS_DIA.parquet")      # TRECHO × dia × ADVP: mín, mediana, ofertas
+AGG_AGENCIAS = str(AGG_DIR / "AGENCIAS_DIA.parquet")    # TRECHO × dia × agência: participação no 1º lugar
+AGG_ULTIMA   = str(AGG_DIR / "ULTIMA_BUSCA.parquet")    # ofertas do dia de busca mais recente de cada TRECHO
+AGG_KEY      = ["TRECHO", "Data/Hora da Busca"]
+_AGG_COLS    = ["Nome do Arquivo", "TRECHO", "Data/Hora da Busca", "ADVP", "Agência/Companhia", "Preço", "Ranking"]
+
+def _key_series(df: pd.DataFrame, cols) -> pd.Series:
+    parts = []
+    for c in cols:
+        s = df[c]
+        if c == "Data/Hora da Busca":
+            s = pd.to_datetime(s, errors="coerce").dt.strftime("%Y-%m-%d")
+        parts.append(s.astype(str))
+    return parts[0].str.cat(parts[1:], sep="|") if len(parts) > 1 else parts[0]
+
+def _agg_keys(df: pd.DataFrame) -> pd.DataFrame:
+    """Pares (TRECHO, dia da busca) distintos das linhas de `df`."""
+    if df is None or df.empty or any(c not in df for c in AGG_KEY):
+        return pd.DataFrame(columns=AGG_KEY)
+    keys = pd.DataFrame({"TRECHO": df["TRECHO"].astype(str),
+                         "Data/Hora da Busca": pd.to_datetime(df["Data/Hora da Busca"], errors="coerce").dt.normalize()})
+    return keys.dropna().drop_duplicates(ignore_index=True)
+
+def _agg_source_df(keys: pd.DataFrame | None, columns=None) -> pd.DataFrame:
+    """Linhas da base-mãe já gravada nas chaves de `keys` (None = todas), sem categóricos."""
+    filt = None
+    if keys is not None:
+        if keys.empty:
+            return pd.DataFrame(columns=columns or [])
+        filt = (ds.field("TRECHO").isin(pa.array(keys["TRECHO"].unique(), type=pa.string())) &
+                ds.field("Data/Hora da Busca").isin(
+                    pa.array(keys["Data/Hora da Busca"].dt.date.unique(), type=pa.date32())))
+    if MASTER_LAYOUT == "dataset":
+        cols = columns + [ROW_ID_COL] if columns else None      # o id descarta duplicatas entre arquivos
+        df = _load_master_dataset_df(filter=filt, columns=cols).drop(columns=[ROW_ID_COL] if columns else [], errors="ignore")
+    elif os.path.exists(MASTER_OUT):
+        df = _table_to_df(_typed_table(ds.dataset(MASTER_OUT, format="parquet").to_table(columns=columns, filter=filt)))
+    else:
+        return pd.DataFrame(columns=columns or [])
+    if keys is not None and not df.empty:
+        # o filtro acima é o produto cartesiano trechos × dias: fica só com os pares pedidos
+        df = df[_key_series(df, AGG_KEY).isin(set(_key_series(keys, AGG_KEY)))]
+    for c in df.select_dtypes("category").columns:
+        df[c] = df[c].astype(str)
+    return df.reset_index(drop=True)
+
+def _agg_precos(df: pd.DataFrame) -> pd.DataFrame:
+    cols = AGG_KEY + ["ADVP", "Ofertas", "Preço Mín", "Preço Mediana", "Agência Mín"]
+    if df.empty:
+        return pd.DataFrame(columns=cols)
+    df = df.assign(**{"Preço": df["Preço"].astype("float64")})
+    g = df.groupby(AGG_KEY + ["ADVP"], sort=False)
+    out = g.agg(**{"Ofertas": ("Preço", "size"), "Preço Mín": ("Preço", "min"),
+                   "Preço Mediana": ("Preço", "median")}).reset_index()
+    out["Agência Mín"] = df.loc[g["Preço"].idxmin().to_numpy(), "Agência/Companhia"].to_numpy()
+    out[["Preço Mín", "Preço Mediana"]] = out[["Preço Mín", "Preço Mediana"]].round(2)
+    return out[cols]
+
+def _agg_agencias(df: pd.DataFrame) -> pd.DataFrame:
+    cols = AGG_KEY + ["Agência/Companhia", "Ofertas", "Preço Mín", "Buscas", "Buscas em 1º", "Participação 1º"]
+    if df.empty:
+        return pd.DataFrame(columns=cols)
+    by = AGG_KEY + ["Agência/Companhia"]
+    out = df.groupby(by, sort=False).agg(**{"Ofertas": ("Preço", "size"), "Preço Mín": ("Preço", "min")})
+    # 1º lugar contado por busca (PDF): empates no menor preço valem para todas as agências empatadas
+    out["Buscas em 1º"] = df[df["Ranking"] == 1].groupby(by)["Nome do Arquivo"].nunique()
+    out = out.reset_index().join(df.groupby(AGG_KEY)["Nome do Arquivo"].nunique().rename("Buscas"), on=AGG_KEY)
+    out["Buscas em 1º"] = out["Buscas em 1º"].fillna(0).astype(int)
+    out["Participação 1º"] = (out["Buscas em 1º"] / out["Buscas"]).round(4)
+    out["Preço Mín"] = out["Preço Mín"].astype("float64").round(2)
+    return out[cols]
+
+def _agg_replace(path: str, fresh: pd.DataFrame, keys: pd.DataFrame | None, key_cols, sort_cols=None):
+    """Troca em `path` as linhas das chaves `keys` por `fresh` (keys=None: reescreve tudo)."""
+    old = _table_to_df(pq.read_table(path)) if keys is not None and os.path.exists(path) else None
+    # sem as colunas-chave o arquivo antigo é um agregado vazio (base-mãe ainda sem ofertas)
+    if old is not None and all(c in old for c in key_cols):
+        hit = _key_series(old, key_cols).isin(set(_key_series(keys, key_cols)))
+        fresh = pd.concat([d for d in (old[~hit], fresh) if not d.empty] or [fresh], ignore_index=True)
+    if not fresh.empty:
+        fresh = fresh.sort_values(sort_cols or key_cols, ignore_index=True)
+    _write_parquet(fresh, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+def update_aggregates(changed: pd.DataFrame | None = None) -> int:
+    """Recalcula os agregados das chaves presentes em `changed` (linhas novas ou
+    removidas); sem `changed`, ou se faltar algum arquivo, reconstrói tudo.
+    Devolve quantas chaves (TRECHO, dia) foram recalculadas (-1 = todas)."""
+    if not AGGREGATES:
+        return 0
+    full = changed is None or not all(os.path.exists(p) for p in (AGG_PRECOS, AGG_AGENCIAS, AGG_ULTIMA))
+    keys = None if full else _agg_keys(changed)
+    if keys is not None and keys.empty:
+        return 0
+    AGG_DIR.mkdir(parents=True, exist_ok=True)
+
+    df = _agg_source_df(keys, _AGG_COLS)
+    _agg_replace(AGG_PRECOS, _agg_precos(df), keys, AGG_KEY, AGG_KEY + ["ADVP"])
+    _agg_replace(AGG_AGENCIAS, _agg_agencias(df), keys, AGG_KEY, AGG_KEY + ["Agência/Companhia"])
+
+    # última busca: o dia mais recente de cada TRECHO tocado sai da tabela de preços já atualizada
+    trechos = None if keys is None else keys[["TRECHO"]].drop_duplicates(ignore_index=True)
+    days = _table_to_df(pq.read_table(AGG_PRECOS, columns=AGG_KEY))
+    days["TRECHO"] = days["TRECHO"].astype(str)
+    if trechos is not None:
+        days = days[days["TRECHO"].isin(set(trechos["TRECHO"]))]
+    latest = days.groupby("TRECHO", sort=False)["Data/Hora da Busca"].max().reset_index()
+    snap = _agg_source_df(latest).drop(columns=[MONTH_COL, *PARTITION_COLS], errors="ignore")
+    _agg_replace(AGG_ULTIMA, snap, trechos, ["TRECHO"], ["TRECHO", "ADVP", "Ranking"])
+    return -1 if keys is None else len(keys)
+
+# ── Planilha (exportação opcional) ────────────────────────────────────────────
+XLSX_DATE_COLS = {"Data do Voo", "Data/Hora da Busca"}
+
+def _iter_parquet_batches(path: str, columns=None):
+    if os.path.isdir(path):
+        yield from _master_dataset(path).to_batches(columns=columns, batch_size=MERGE_BATCH_ROWS)
+    elif os.path.exists(path):
+        yield from pq.ParquetFile(path).iter_batches(batch_size=MERGE_BATCH_ROWS, columns=columns)
+
+XLSX_MAX_ROWS = 1_048_576                # limite de linhas de uma planilha do Excel (com o cabeçalho)
+
+def _write_sheet(wb, title: str, path: str, front_cols):
+    """Grava `path` em `title`; acima do limite do Excel continua em title_2, title_3..."""
+    from openpyxl.cell import WriteOnlyCell
+
+    ws = wb.create_sheet(title)
+    if os.path.isdir(path):
+        names = _master_dataset(path).schema.names
+    elif os.path.exists(path):
+        names = pq.read_schema(path).names
+    else:
+        names = []
+    names = [c for c in names if c not in (ROW_ID_COL, ERR_ID_COL) and c not in (PARTITION_COLS if os.path.isdir(path) else [])]
+    cols = [c for c in front_cols if c in names] + [c for c in names if c not in front_cols]
+    ws.append(cols)
+    date_idx = [i for i, c in enumerate(cols) if c in XLSX_DATE_COLS]
+    n, rows_in_sheet, sheets = 0, 1, 1
+    for batch in _iter_parquet_batches(path, columns=cols):
+        # decimal (Preço) vai como número; float32 de base-mãe antiga viraria
+        # 1234.56005859375 na planilha
+        data = [col.cast(pa.float64()).to_pylist() if pa.types.is_decimal(col.type)
+                else [None if v is None else round(v, 2) for v in col.to_pylist()]
+                if pa.types.is_float32(col.type) else col.to_pylist()
+                for col in (batch.column(c) for c in cols)]
+        for row in zip(*data):
+            if rows_in_sheet >= XLSX_MAX_ROWS:
+                sheets += 1
+                ws = wb.create_sheet(f"{title}_{sheets}")
+                ws.append(cols)
+                rows_in_sheet = 1
+            row = list(row)
+            for i in date_idx:
+                if row[i] is not None:
+                    cell = WriteOnlyCell(ws, value=row[i])
+                    cell.number_format = "DD/MM/YYYY"
+                    row[i] = cell
+            ws.append(row)
+            rows_in_sheet += 1
+            n += 1
+    return n
+
+def export_workbook(file_path: str = MATRIX_XLSX) -> tuple[int, int]:
+    """Gera OFERTASMATRIZ.xlsx a partir dos parquets (base-mãe + histórico de erros)
+    com o writer write-only do openpyxl, em streaming. Não faz parte do ciclo."""
+    from openpyxl import Workbook
+
+    master = MASTER_DATASET if MASTER_LAYOUT == "dataset" and _dataset_exists() else MASTER_OUT
+    if master == MASTER_OUT and not os.path.exists(master):
+        src = _master_source()
+        master = str(src) if src is not None else master
+    wb = Workbook(write_only=True)
+    n_of = _write_sheet(wb, SHEET_OFERTAS, master, OF_ID_COLS + ["Ranking"])
+    n_er = _write_sheet(wb, SHEET_ERROS, ERRORS_OUT, ["Nome do Arquivo", "Erro", "Trecho", "Pagina"])
+    tmp = file_path + ".tmp"
+    wb.save(tmp)
+    os.replace(tmp, file_path)
+    print(f"[{datetime.now():%H:%M:%S}] Planilha {file_path}: {n_of} oferta(s), {n_er} erro(s).")
+    return n_of, n_er
 
 # ── 1 ciclo de atualização ────────────────────────────────────────────────────
-def run_cycle():
-    pdfs = sorted(glob.glob(os.path.join(PDF_DIR, "*.pdf")))
-    print(f"[{datetime.now():%H:%M:%S}] PDFs na pasta: {len(pdfs)}")
-    if not pdfs:
-        master = _load_master_df()
-        if not master.empty:
-            _save_master_out(master)
-        return pd.DataFrame(), pd.DataFrame(), 0, 0
-
-    # Cache simples (mtime+tamanho)
-    state = load_state()
-    def _sig(p: str) -> str | None:
-        try:
-            st = os.stat(p)
-            return f"{st.st_size}-{int(st.st_mtime)}"
-        except Exception:
-            return None
+def _sig(p: str) -> str | None:
+    try:
+        st = os.stat(p)
+        return f"{st.st_size}-{int(st.st_mtime)}"
+    except Exception:
+        return None
 
+def select_pending(pdfs, state: FileState, index: FileIndex) -> tuple[list, dict]:
+    """Filtra `pdfs` pelo estado (mtime+tamanho) e pelo índice de conteúdo.
+    Devolve (a processar, {caminho: (md5, sha1, tamanho)})."""
     to_process = []
     for p in pdfs:
         sig = _sig(p)
         if sig is None:
             continue
-        if state.get(p) != sig:
+        if state.sig(_state_key(p)) != sig:
             to_process.append(p)
 
-    if not to_process:
-        print(f"[{datetime.now():%H:%M:%S}] Nada novo. Todos os PDFs já convertidos.")
-        master = _load_master_df()
-        if not master.empty:
-            _save_master_out(master)
-        return pd.DataFrame(), pd.DataFrame(), 0, 0
-
-    print(f"[{datetime.now():%H:%M:%S}] Novos/alterados: {len(to_process)} de {len(pdfs)}")
-
-    offers_rows, errors_rows = [], []
-    for path in tqdm(to_process, desc="Processando PDFs"):
-        fn = os.path.basename(path)
-
-        code, trecho = first_page_error_code(path)
-        if code:
-            errors_rows.append({"Nome do Arquivo": fn, "Erro": code, "Trecho": trecho, "Pagina": 1})
-
-        flight_info, err = extract_flight_info(path)
-        if err:
-            errors_rows.append({"Nome do Arquivo": fn, "Erro": err, "Trecho": "", "Pagina": 1})
-
-        offers, sdt = extract_offers_from_pdf(path, "")
-        for o in offers:
-            offers_rows.append({
-                "Nome do Arquivo": fn,
-                **(flight_info or {}),
-                "Data/Hora da Busca": sdt,
-                **o,
-                "TRECHO": get_trecho(fn)
-            })
+    # Conteúdo já convertido (mesmo md5, ainda que com outro nome) não é reprocessado
+    hashes, fresh, dups = {}, [], []
+    seen = set()
+    for p in to_process:
+        try:
+            hashes[p] = file_hashes(p)
+        except OSError:
+            continue
+        md5 = hashes[p][0]
+        if index.is_parsed(md5) or md5 in seen:
+            dups.append((_state_key(p), _sig(p), "duplicado", md5, 0, 0, None))
+        else:
+            fresh.append(p)
+            seen.add(md5)
+    if dups:
+        print(f"[{datetime.now():%H:%M:%S}] Conteúdo já convertido (índice): {len(dups)}")
+        state.mark(dups)
+    return fresh, hashes
+
+def select_pending_downloads(items, index: FileIndex) -> tuple[list, dict]:
+    """select_pending para downloads em memória (drive_pull.Download): os hashes
+    vieram do próprio download e não há arquivo em inbox/ a comparar com o estado.
+    Devolve (itens a processar, {caminho: (md5, sha1, tamanho)})."""
+    fresh, hashes, dups = [], {}, 0
+    for d in items:
+        if index.is_parsed(d.md5):
+            dups += 1
+            continue
+        fresh.append(d)
+        hashes[str(d.path)] = (d.md5, d.sha1, d.size)
+    if dups:
+        print(f"[{datetime.now():%H:%M:%S}] Conteúdo já convertido (índice): {dups}")
+    return fresh, hashes
 
+def postprocess_offers(offers_rows: list) -> pd.DataFrame:
     new_offers_df = pd.DataFrame(offers_rows)
-    new_erros_df  = pd.DataFrame(errors_rows)
-
     if not new_offers_df.empty:
         new_offers_df["Data do Voo"] = pd.to_datetime(new_offers_df["Data do Voo"], dayfirst=True, errors="coerce")
         so_data = new_offers_df["Data/Hora da Busca"].astype(str).str.extract(r"(\d{2}/\d{2}/\d{4})", expand=False)
@@ -369,60 +1335,371 @@ def run_cycle():
         req = ["Nome do Arquivo","Companhia Aérea","Horário1","Horário2","Horário3",
                "Tipo de Voo","Data do Voo","Data/Hora da Busca",
                "Agência/Companhia","Preço","TRECHO","ADVP","Ranking"]
-        new_offers_df = new_offers_df[new_offers_df.apply(lambda r: todas_colunas_preenchidas(r, req), axis=1)]
+        new_offers_df = new_offers_df[todas_colunas_preenchidas(new_offers_df, req)]
         new_offers_df = new_offers_df[new_offers_df["Agência/Companhia"].str.lower() != "skyscanner"]
         new_offers_df = to_upper_df(new_offers_df)
-
-    if not new_erros_df.empty:
-        new_erros_df = to_upper_df(new_erros_df)
-
-    # Excel e erros parquet (auditoria)
-    try:
-        base_ofertas = pd.read_excel(MATRIX_XLSX, sheet_name=SHEET_OFERTAS, engine="openpyxl")
-    except Exception:
-        base_ofertas = pd.DataFrame()
+    return new_offers_df
+
+def commit_batch(paths, results, hashes: dict, state: FileState, index: FileIndex):
+    """Grava um lote já extraído: erros, incremento/base-mãe (em lotes, ver
+    flush_batches), estado e índice.
+    `results` são os (linhas de ofertas, linhas de erros) de cada caminho, na ordem.
+    O estado só é gravado depois dos lotes: uma queda no meio faz o lote ser
+    reprocessado, e os ids evitam linhas duplicadas. Falhas de processamento
+    (timeout, worker, exceção: Pagina 0) vão para os erros, mas não para o estado
+    nem para o índice: o arquivo é tentado de novo no próximo ciclo."""
+    offers_rows, errors_rows, parsed, marks = [], [], [], []
+    for p, (of_rows, er_rows) in zip(paths, results):
+        offers_rows.extend(of_rows)
+        errors_rows.extend(er_rows)
+        if is_failure(er_rows):
+            continue
+        md5, sha1, size = hashes[p]
+        parsed.append((md5, sha1, os.path.basename(p), size, len(of_rows)))
+        status = "ok" if of_rows or not er_rows else "erro"
+        marks.append((_state_key(p), _sig(p), status, md5, len(of_rows), len(er_rows),
+                      er_rows[0]["Erro"] if er_rows else None))
+
+    with METRICS.timer("postprocess"):
+        new_offers_df = postprocess_offers(offers_rows)
+        new_erros_df  = pd.DataFrame(errors_rows)
+        if not new_erros_df.empty:
+            new_erros_df = to_upper_df(new_erros_df)
+
+    # erros, incremento e ofertas novas (dedupe) vão para lotes; flush_batches() os incorpora
+    with METRICS.timer("merge"):
+        if not new_erros_df.empty:
+            _write_segment("ERROS", _with_error_ids(new_erros_df))
+        export_increment_and_update_master(new_offers_df)
+    if MASTER_LAYOUT == "dataset":
+        # no dataset as linhas já estão nas partições; no layout "file" os agregados saem no flush
+        with METRICS.timer("aggregates"):
+            METRICS.count("aggregate_keys", max(0, update_aggregates(new_offers_df)))
+
+    # estado + índice
+    with METRICS.timer("state"):
+        state.mark([m for m in marks if m[1] is not None])
+        index.mark_parsed(parsed)
+    METRICS.count("pdfs", len(paths))
+    METRICS.count("offers", len(new_offers_df))
+    METRICS.count("errors", len(new_erros_df))
+    return new_offers_df, new_erros_df
+
+def flush_metrics(mode: str, status: str = "ok") -> dict:
+    """Fecha as métricas do ciclo (JSONL/Prometheus/profiles) e mostra os mais lentos."""
+    slow = METRICS.slowest(3)
+    summary = METRICS.flush(mode=mode, status=status)
+    if slow:
+        print(f"[{datetime.now():%H:%M:%S}] Mais lentos: " +
+              ", ".join(f"{r['file']} ({r.get('total', 0):.1f}s)" for r in slow))
+    return summary
+
+def _concat_parts(parts) -> pd.DataFrame:
+    parts = [d for d in parts if not d.empty]
+    return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+
+def run_cycle(workers: int = WORKERS, timeout: float = FILE_TIMEOUT_SEC, paths=None):
+    """Um ciclo sobre `paths` (ou, sem eles, sobre todos os PDFs de PDF_DIR).
+    Devolve (ofertas, erros, n_ofertas, n_erros); sem nada novo os DataFrames vêm
+    como None e o pandas nem chega a ser importado."""
+    status = "erro"
     try:
-        base_erros = pd.read_excel(MATRIX_XLSX, sheet_name=SHEET_ERROS, engine="openpyxl")
-    except Exception:
-        base_erros = pd.DataFrame()
-
-    final_ofertas = pd.concat([base_ofertas, new_offers_df], ignore_index=True) if not new_offers_df.empty else base_ofertas
-    final_erros   = pd.concat([base_erros, new_erros_df], ignore_index=True) if not new_erros_df.empty else base_erros
-    if not final_ofertas.empty or base_ofertas.empty:
-        write_back_preserving(MATRIX_XLSX, final_ofertas, final_erros)
-    if not new_erros_df.empty:
-        _to_datetime_cols(new_erros_df).to_parquet(PARQUET_ERR, index=False)
-
-    # incremento + atualizar base-mãe (dedupe)
-    export_increment_and_update_master(new_offers_df)
-
-    # cache
-    for p in to_process:
-        try:
-            st = os.stat(p)
-            state[p] = f"{st.st_size}-{int(st.st_mtime)}"
-        except Exception:
-            pass
-    save_state(state)
+        result = _run_cycle(workers, timeout, paths)
+        status = "ok"
+        return result
+    finally:
+        flush_metrics("cycle", status)
+
+def _run_cycle(workers: int, timeout: float, paths):
+    if paths is None:
+        pdfs = sorted(glob.glob(os.path.join(PDF_DIR, "*.pdf")))
+        print(f"[{datetime.now():%H:%M:%S}] PDFs na pasta: {len(pdfs)}")
+    else:
+        pdfs = sorted(paths)
+        print(f"[{datetime.now():%H:%M:%S}] PDFs recebidos: {len(pdfs)}")
+
+    with open_state() as state, FileIndex() as index:
+        if paths is None:
+            pruned = state.prune(_state_key(p) for p in pdfs)
+            if pruned:
+                print(f"[{datetime.now():%H:%M:%S}] Estado: {pruned} arquivo(s) que saíram da pasta removido(s).")
+        if not pdfs:
+            flush_batches()
+            return None, None, 0, 0
+
+        with METRICS.timer("select"):
+            to_process, hashes = select_pending(pdfs, state, index)
+
+        if not to_process:
+            print(f"[{datetime.now():%H:%M:%S}] Nada novo. Todos os PDFs já convertidos.")
+            flush_batches()                     # lotes que sobraram de um ciclo interrompido
+            return None, None, 0, 0
+
+        print(f"[{datetime.now():%H:%M:%S}] Novos/alterados: {len(to_process)} de {len(pdfs)}")
+
+        # merge a cada COMMIT_EVERY PDFs: uma queda no meio só perde o lote corrente
+        offers_parts, erros_parts, batch = [], [], []
+        t_commit = 0.0
+        def commit():
+            nonlocal t_commit
+            if batch:
+                t0 = time.perf_counter()
+                of_df, er_df = commit_batch([p for p, _ in batch], [r for _, r in batch], hashes, state, index)
+                offers_parts.append(of_df); erros_parts.append(er_df)
+                batch.clear()
+                t_commit += time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        desc = "Processando PDFs" + (f" ({workers} workers)" if workers > 1 else "")
+        from tqdm import tqdm
+        with tqdm(total=len(to_process), desc=desc) as bar:
+            # sha1 já calculado na seleção: o PdfDoc não relê o arquivo para achar o cache
+            # o pool termina fora de ordem: os resultados esperam em `ready` e entram nos
+            # lotes pela ordem de entrada, então lotes e base-mãe não dependem do agendamento
+            ready, next_i = {}, 0
+            for i, p, res in iter_processed(to_process, workers, timeout, [hashes[p][1] for p in to_process]):
+                ready[i] = (p, res)
+                bar.update(1)
+                while next_i in ready:
+                    batch.append(ready.pop(next_i))
+                    next_i += 1
+                    if len(batch) >= COMMIT_EVERY:
+                        commit()
+            commit()
+        METRICS.observe("extract", time.perf_counter() - t0 - t_commit)
+        flush_batches()
+        if TEXT_CACHE:
+            TEXT_CACHE.prune()                  # uma varredura do cache por ciclo, não por lote
+
+    new_offers_df, new_erros_df = _concat_parts(offers_parts), _concat_parts(erros_parts)
+    return new_offers_df, new_erros_df, len(new_offers_df), len(new_erros_df)
+
+# ── Reprocessamento (backfill) ────────────────────────────────────────────────
+def _master_names(since=None, until=None) -> set:
+    """Nomes (caixa alta) na base-mãe; com since/until, só os de buscas nesse intervalo."""
+    ranged = since is not None or until is not None
+    df = _load_master_df(columns=["Nome do Arquivo"] + (["Data/Hora da Busca"] if ranged else []))
+    if df.empty or "Nome do Arquivo" not in df:
+        return set()
+    if ranged:
+        dt = pd.to_datetime(df["Data/Hora da Busca"], errors="coerce").dt.normalize()
+        keep = dt.notna()
+        if since is not None: keep &= dt >= since
+        if until is not None: keep &= dt <= until
+        df = df[keep]
+    return set(df["Nome do Arquivo"].dropna().astype(str).str.strip().str.upper())
+
+def select_reparse_targets(index: FileIndex, patterns=None, since=None, until=None) -> list:
+    """Arquivos a reprocessar: os da base-mãe no intervalo de datas de busca ou, sem
+    intervalo, tudo o que já passou por aqui (base-mãe, índice e inbox/). `patterns`
+    (curingas, sem diferenciar caixa) restringem a seleção."""
+    if since is not None or until is not None:
+        names = _master_names(since, until)
+    else:
+        names = _master_names() | set(index.sha1_by_name())
+        names |= {os.path.basename(p).upper() for p in glob.glob(os.path.join(PDF_DIR, "*.pdf"))}
+    if patterns:
+        pats = [p.upper() for p in patterns]
+        names = {n for n in names if any(fnmatch.fnmatchcase(n, p) for p in pats)}
+    return sorted(names)
+
+def _reparse_sources(names, index: FileIndex) -> tuple[list, list, list]:
+    """Para cada nome: o PDF em inbox/ ou, sem ele, o texto no cache (pelo sha1 do
+    índice). Devolve (caminhos, sha1s, nomes sem fonte)."""
+    inbox = {os.path.basename(p).upper(): p for p in glob.glob(os.path.join(PDF_DIR, "*.pdf"))}
+    by_name = index.sha1_by_name()
+    paths, sha1s, missing = [], [], []
+    for n in names:
+        if n in inbox:
+            paths.append(inbox[n]); sha1s.append(None)
+        elif TEXT_CACHE and n in by_name and TEXT_CACHE.has(by_name[n][1]):
+            name, sha1 = by_name[n]
+            paths.append(os.path.join(PDF_DIR, name)); sha1s.append(sha1)
+        else:
+            missing.append(n)
+    return paths, sha1s, missing
 
-    return final_ofertas, final_erros, len(new_offers_df), len(new_erros_df)
+def _process_or_fail(path, sha1=None):
+    try:
+        return process_pdf_recorded(path, sha1)
+    except Exception as e:
+        return _failure_rows(path, "ERRO PROCESSAMENTO", f"{type(e).__name__}: {e}")
+
+def _diff_rows(old: pd.DataFrame, new: pd.DataFrame) -> dict:
+    """Compara as linhas antigas e novas dos arquivos reprocessados pelo id."""
+    o = old.drop_duplicates(ROW_ID_COL, keep="last").set_index(ROW_ID_COL)
+    n = new.drop_duplicates(ROW_ID_COL, keep="last").set_index(ROW_ID_COL)
+    both = o.index.intersection(n.index)
+    cols = [c for c in n.columns if c in o.columns]
+    changed = 0
+    if len(both) and cols:
+        a = o.loc[both, cols].astype(str).to_numpy()
+        b = n.loc[both, cols].astype(str).to_numpy()
+        changed = int((a != b).any(axis=1).sum())
+    return {"adicionadas": len(n.index.difference(o.index)),
+            "removidas": len(o.index.difference(n.index)),
+            "alteradas": changed}
+
+def reparse(patterns=None, since=None, until=None,
+            workers: int = WORKERS, timeout: float = FILE_TIMEOUT_SEC) -> dict:
+    """Reextrai os arquivos selecionados e substitui as linhas deles na base-mãe e no
+    histórico de erros. Arquivos que falham (timeout, exceção) mantêm as linhas antigas."""
+    flush_batches()                             # a substituição parte da base-mãe completa
+    with FileIndex() as index:
+        names = select_reparse_targets(index, patterns, since, until)
+        paths, sha1s, missing = _reparse_sources(names, index)
+    print(f"[{datetime.now():%H:%M:%S}] Reprocessar: {len(names)} arquivo(s); "
+          f"{sum(h is not None for h in sha1s)} só pelo cache de texto; {len(missing)} sem fonte.")
+    summary = {"arquivos": 0, "sem_fonte": len(missing), "falhas": 0,
+               "adicionadas": 0, "removidas": 0, "alteradas": 0}
+    if not paths:
+        return summary
+
+    if workers > 1:
+        results = process_pdfs_parallel(paths, workers, timeout, sha1s)
+    else:
+        from tqdm import tqdm
+        results = [_process_or_fail(p, h) for p, h in tqdm(list(zip(paths, sha1s)), desc="Reprocessando PDFs")]
+
+    done, offers_rows, errors_rows = [], [], []
+    for p, (of_rows, er_rows) in zip(paths, results):
+        if is_failure(er_rows):
+            summary["falhas"] += 1
+            print(f"  ⚠️ {os.path.basename(p)}: {er_rows[-1]['Erro']} — linhas antigas mantidas.")
+            continue
+        done.append(os.path.basename(p).upper())
+        offers_rows.extend(of_rows)
+        errors_rows.extend(er_rows)
+    summary["arquivos"] = len(done)
+    if not done:
+        return summary
+
+    new_offers = _with_row_ids(postprocess_offers(offers_rows))
+    new_erros = _with_error_ids(to_upper_df(pd.DataFrame(errors_rows)))
+
+    if MASTER_LAYOUT == "dataset":
+        removed, added = _replace_in_dataset(done, new_offers)
+    else:
+        src = _master_source()
+        if src is not None and ROW_ID_COL not in pq.read_schema(src).names:
+            print(f"[{datetime.now():%H:%M:%S}] Base-mãe sem '{ROW_ID_COL}': migrando (única vez).")
+            _rebuild_master(_load_master_df(), pd.DataFrame())
+            src = Path(MASTER_OUT)
+        removed, added = _append_parquet(src, MASTER_OUT, _sort_master(new_offers), drop_names=done)
+    if os.path.exists(ERRORS_OUT) or not new_erros.empty:
+        _append_parquet(ERRORS_OUT if os.path.exists(ERRORS_OUT) else None, ERRORS_OUT,
+                        new_erros, drop_names=done)
+
+    removed, added = _table_to_df(removed), _table_to_df(added)
+    update_aggregates(_concat_parts([removed, added]))
+    summary.update(_diff_rows(removed, added))
+    print(f"[{datetime.now():%H:%M:%S}] Reprocessados {summary['arquivos']} arquivo(s): "
+          f"+{summary['adicionadas']} -{summary['removidas']} ~{summary['alteradas']} linha(s); "
+          f"falhas: {summary['falhas']}; sem fonte: {summary['sem_fonte']}.")
+    return summary
 
 # ── CLI ───────────────────────────────────────────────────────────────────────
-if __name__ == "__main__":
+def main(argv=None) -> int:
+    global MASTER_LAYOUT
     ap = argparse.ArgumentParser()
     ap.add_argument("--once", action="store_true", help="Executa apenas 1 ciclo.")
-    args = ap.parse_args()
+    ap.add_argument("--workers", type=int, default=WORKERS,
+                    help="Processos para extrair PDFs em paralelo (env PDF27_WORKERS; 1 = serial).")
+    ap.add_argument("--timeout", type=float, default=FILE_TIMEOUT_SEC,
+                    help="Tempo máximo por PDF em segundos no modo paralelo (env PDF27_FILE_TIMEOUT_SEC; 0 = sem limite).")
+    ap.add_argument("--partitioned", action="store_true",
+                    help="Base-mãe como dataset particionado em out/OFERTAS/ (padrão; env MASTER_LAYOUT=dataset).")
+    ap.add_argument("--single-file", action="store_true",
+                    help="Base-mãe como um OFERTAS.parquet único, reescrito a cada ciclo (env MASTER_LAYOUT=file).")
+    ap.add_argument("--compact", action="store_true",
+                    help="Compacta os arquivos pequenos de cada partição do dataset e sai.")
+    ap.add_argument("--watch", action="store_true",
+                    help="Daemon: processa PDFs assim que chegam em inbox/ (inotify, ou polling como fallback).")
+    ap.add_argument("--debounce", type=float, default=DEBOUNCE_SEC,
+                    help="Segundos sem novas chegadas para fechar um lote no --watch (env PDF27_DEBOUNCE_SEC).")
+    ap.add_argument("--reparse", action="store_true",
+                    help="Reprocessa arquivos já convertidos (PDF em inbox/ ou texto do cache) e substitui suas linhas na base-mãe.")
+    ap.add_argument("--files", nargs="+", metavar="PADRAO",
+                    help="Com --reparse: nomes ou curingas dos arquivos (ex.: 'GRU_SSA_*').")
+    ap.add_argument("--since", help="Com --reparse: data de busca inicial (DD/MM/AAAA).")
+    ap.add_argument("--until", help="Com --reparse: data de busca final, inclusive (DD/MM/AAAA).")
+    ap.add_argument("--aggregates", action="store_true",
+                    help="Reconstrói os agregados de out/AGREGADOS/ a partir da base-mãe e sai.")
+    ap.add_argument("--xlsx", action="store_true",
+                    help="Gera OFERTASMATRIZ.xlsx a partir dos parquets ao fim de cada ciclo.")
+    ap.add_argument("--export-xlsx", action="store_true",
+                    help="Só gera OFERTASMATRIZ.xlsx a partir dos parquets e sai.")
+    args = ap.parse_args(argv)
+    if args.partitioned:
+        MASTER_LAYOUT = "dataset"
+    elif args.single_file:
+        MASTER_LAYOUT = "file"
+
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+
+    if args.compact:
+        compact_master_dataset()
+        return 0
+    if args.export_xlsx:
+        export_workbook()
+        return 0
+    if args.aggregates:
+        update_aggregates()
+        return 0
+    if args.reparse:
+        since = pd.to_datetime(args.since, dayfirst=True) if args.since else None
+        until = pd.to_datetime(args.until, dayfirst=True) if args.until else None
+        reparse(args.files, since, until, args.workers, args.timeout)
+        flush_metrics("reparse")
+        if args.xlsx:
+            export_workbook()
+        return 0
+
+    if args.watch:
+        from inbox_watch import watch_batches
+
+        # varredura completa só na partida; depois, só o que chega
+        paths, batches = None, None
+        try:
+            batches = watch_batches(PDF_DIR, debounce=args.debounce, poll_interval=args.debounce)
+            while True:
+                try:
+                    start = datetime.now()
+                    of_df, er_df, n_of, n_er = run_cycle(args.workers, args.timeout, paths=paths)
+                    print(f"✅ Lote concluído {start:%d/%m %H:%M:%S}. Ofertas novas: {n_of} | Erros novos: {n_er}")
+                    if args.xlsx:
+                        export_workbook()
+                except Exception as e:
+                    print(f"❌ Erro no lote: {e}")
+                print(f"👀 Aguardando PDFs em {PDF_DIR}...", flush=True)
+                paths = next(batches)      # None = eventos perdidos: reescaneia tudo
+        except OSError as e:
+            print(f"❌ Observador de {PDF_DIR} falhou: {e}", flush=True)
+            return 1
+        finally:
+            # lotes de um ciclo interrompido (Ctrl+C, falha do observador) entram na base
+            flush_batches()
+            if batches is not None:
+                batches.close()
 
     if args.once:
-        of_df, er_df, n_of, n_er = run_cycle()
+        of_df, er_df, n_of, n_er = run_cycle(args.workers, args.timeout)
         print(f"✅ Ciclo concluído. Ofertas novas: {n_of} | Erros novos: {n_er}")
+        if args.xlsx:
+            export_workbook()
     else:
         while True:
             try:
                 start = datetime.now()
-                of_df, er_df, n_of, n_er = run_cycle()
+                of_df, er_df, n_of, n_er = run_cycle(args.workers, args.timeout)
                 print(f"✅ Ciclo concluído {start:%d/%m %H:%M:%S}. Ofertas novas: {n_of} | Erros novos: {n_er}")
+                if args.xlsx:
+                    export_workbook()
             except Exception as e:
                 print(f"❌ Erro no ciclo: {e}")
             print(f"⏲️ Próxima execução em 10 minutos.")
             time.sleep(LOOP_INTERVAL_SEC)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
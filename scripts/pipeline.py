@@ -0,0 +1,162 @@
+# scripts/pipeline.py
+"""Drive → PDF → base-mãe em streaming: baixa, extrai e grava ao mesmo tempo.
+
+    python scripts/pipeline.py [--folder ID] [--workers N] [--batch 50]
+
+Três estágios ligados por filas limitadas:
+  1. download (drive_pull, em thread) entrega cada arquivo salvo em inbox/;
+  2. extração (PdfWorkerPool do pdf27, em processos via forkserver) recebe os PDFs
+     conforme chegam;
+  3. merge (pdf27.commit_batch) grava as linhas em lotes de --batch arquivos ou a
+     cada --batch-sec segundos; a base-mãe é reescrita uma vez, no fim do run.
+Se a fila de extração encher, o download espera (backpressure).
+
+Um arquivo só é marcado como convertido no merge do seu lote. Se o processo cair,
+o que já foi baixado continua em inbox/ e a varredura inicial do próximo run o
+processa. Por isso a primeira coisa que este script faz é um run_cycle completo.
+
+Com --in-memory (env PIPELINE_IN_MEMORY=1) o PDF vai do download direto para a
+extração, sem passar pelo disco; o original só fica em inbox/ com
+DRIVE_KEEP_ORIGINALS=1. Nesse modo o estado do sync só é gravado depois do último
+merge: se o processo cair antes, o próximo run baixa de novo o que se perdeu.
+
+Um PDF cuja extração falha (timeout, worker, exceção) sai do estado do sync e o
+token do Drive não avança além dele: o próximo run o baixa e extrai de novo, sem
+depender de inbox/ (que o CI não guarda entre execuções).
+"""
+import os, sys, time, queue, argparse, threading
+from datetime import datetime
+
+QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE", "64"))
+BATCH_FILES = int(os.environ.get("PIPELINE_BATCH", "50"))
+BATCH_SEC = float(os.environ.get("PIPELINE_BATCH_SEC", "30"))
+IN_MEMORY = os.environ.get("PIPELINE_IN_MEMORY", "0") in ("1", "true", "yes")
+
+_DONE = object()
+
+def run_pipeline(folder: str, workers: int, timeout: float, batch_files: int = BATCH_FILES,
+                 batch_sec: float = BATCH_SEC, queue_size: int = QUEUE_SIZE,
+                 in_memory: bool = IN_MEMORY) -> tuple[int, int]:
+    import pdf27
+    import drive_pull
+    from ofertas_index import FileIndex
+
+    # recuperação: o que ficou em inbox/ sem converter (queda anterior, run manual...)
+    _, _, n_of, n_er = pdf27.run_cycle(workers, timeout)
+
+    downloads = queue.Queue(maxsize=queue_size)
+    failure, sync = [], {}
+    start_token = drive_pull.load_sync_state().get("start_page_token")
+
+    def producer():
+        try:
+            sync["state"] = drive_pull.run(
+                on_file=lambda p, fid: downloads.put((p, fid)) if str(p).lower().endswith(".pdf") else None,
+                folder_id=folder, in_memory=in_memory, save_state=not in_memory)
+        except BaseException as e:          # reapresentado na thread principal
+            failure.append(e)
+        finally:
+            downloads.put(_DONE)
+
+    state = pdf27.open_state()
+    index = FileIndex()
+    # workers (e os que substituem os que caem) vêm do forkserver: as threads do
+    # download não são herdadas por um fork no meio de uma requisição
+    pool = pdf27.PdfWorkerPool(workers, timeout, start_method="forkserver")
+    producer_thread = threading.Thread(target=producer, name="drive-pull", daemon=True)
+    producer_thread.start()
+
+    seq, hashes, done = 0, {}, {}
+    in_flight, failed_ids = {}, set()       # seq -> id no Drive até o resultado chegar
+    last_merge = time.monotonic()
+    downloads_open = True
+
+    def merge():
+        nonlocal n_of, n_er, last_merge
+        last_merge = time.monotonic()
+        if not done:
+            return
+        keys = sorted(done)
+        paths = [done[k][0] for k in keys]
+        results = [done[k][1] for k in keys]
+        done.clear()
+        of_df, er_df = pdf27.commit_batch(paths, results, hashes, state, index)
+        n_of += len(of_df); n_er += len(er_df)
+        print(f"[{datetime.now():%H:%M:%S}] [merge] {len(paths)} PDF(s): "
+              f"{len(of_df)} oferta(s), {len(er_df)} erro(s).", flush=True)
+
+    try:
+        while downloads_open or pool.pending:
+            # alimenta a extração sem deixar a fila interna do pool crescer além do necessário
+            while downloads_open and pool.pending < workers * 2:
+                try:
+                    item = downloads.get(timeout=0.05 if pool.pending else 0.5)
+                except queue.Empty:
+                    break
+                if item is _DONE:
+                    downloads_open = False
+                    break
+                item, fid = item
+                if in_memory:
+                    pending, h = pdf27.select_pending_downloads([item], index)
+                    for d in pending:
+                        pool.submit(seq, str(d.path), d.sha1, d.data)
+                        in_flight[seq] = fid; seq += 1
+                else:
+                    pending, h = pdf27.select_pending([str(item)], state, index)
+                    for p in pending:
+                        pool.submit(seq, p, h[p][1])
+                        in_flight[seq] = fid; seq += 1
+                hashes.update(h)
+
+            for key, path, of_rows, er_rows in pool.poll(wait=0.05):
+                done[key] = (path, (of_rows, er_rows))
+                fid = in_flight.pop(key)
+                if pdf27.is_failure(er_rows):
+                    failed_ids.add(fid)
+
+            if len(done) >= batch_files or (done and time.monotonic() - last_merge >= batch_sec):
+                merge()
+        merge()
+        pdf27.flush_batches()              # base-mãe e erros reescritos uma vez no run
+        if pdf27.TEXT_CACHE:
+            pdf27.TEXT_CACHE.prune()
+    finally:
+        pool.close()
+        index.close()
+        state.close()
+        pdf27.flush_metrics("pipeline")
+    producer_thread.join()
+    if failure:
+        raise failure[0]
+    if in_memory or failed_ids:
+        # o que falhou na extração volta a ser baixado no próximo run
+        drive_pull.forget_files(sync["state"], failed_ids, start_token)
+        drive_pull.save_sync_state(sync["state"])
+    return n_of, n_er
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--folder", default=os.environ.get("DRIVE_FOLDER_ID"),
+                    help="Pasta do Drive (env DRIVE_FOLDER_ID).")
+    ap.add_argument("--workers", type=int, default=int(os.environ.get("PDF27_WORKERS", "2")),
+                    help="Processos de extração (env PDF27_WORKERS).")
+    ap.add_argument("--timeout", type=float, default=float(os.environ.get("PDF27_FILE_TIMEOUT_SEC", "120")),
+                    help="Tempo máximo por PDF em segundos (env PDF27_FILE_TIMEOUT_SEC).")
+    ap.add_argument("--batch", type=int, default=BATCH_FILES,
+                    help="PDFs por lote de merge (env PIPELINE_BATCH).")
+    ap.add_argument("--batch-sec", type=float, default=BATCH_SEC,
+                    help="Merge ao menos a cada N segundos (env PIPELINE_BATCH_SEC).")
+    ap.add_argument("--in-memory", action="store_true", default=IN_MEMORY,
+                    help="Extrai direto dos bytes baixados, sem gravar em inbox/ (env PIPELINE_IN_MEMORY).")
+    args = ap.parse_args(argv)
+    if not args.folder:
+        print("Defina DRIVE_FOLDER_ID (secret) ou passe --folder <FOLDER_ID>.", flush=True)
+        return 1
+    n_of, n_er = run_pipeline(args.folder, max(1, args.workers), args.timeout, args.batch, args.batch_sec,
+                              in_memory=args.in_memory)
+    print(f"✅ Pipeline concluído. Ofertas novas: {n_of} | Erros novos: {n_er}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+# scripts/text_cache.py
+"""Cache em disco do texto extraído de cada página de PDF.
+
+A chave é o sha1 do conteúdo do arquivo; o diretório inclui a versão do
+pdfplumber, então uma atualização da biblioteca invalida tudo sozinha. Cada
+entrada é um JSON gzip com o número de páginas e o texto das páginas já
+extraídas (pode ser parcial: páginas novas são completadas na próxima leitura).
+
+Reprocessar o histórico com regras novas passa a custar só o regex/parsing,
+sem a análise de layout do pdfplumber. O tamanho total é limitado por
+PDF27_TEXT_CACHE_MB; as entradas menos usadas recentemente (mtime) saem primeiro.
+"""
+import os, gzip, json, hashlib
+from functools import cached_property
+from pathlib import Path
+
+# fora de out/: o artifact dos convertidos publica out/ inteiro, e o cache não é saída
+CACHE_DIR = os.environ.get("PDF27_TEXT_CACHE", ".cache/text").strip()   # vazio desliga
+CACHE_MAX_MB = float(os.environ.get("PDF27_TEXT_CACHE_MB", "512"))
+FORMAT = 1
+
+def content_sha1(path) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _version_tag() -> str:
+    import pdfplumber
+    return f"pdfplumber-{pdfplumber.__version__}-f{FORMAT}"
+
+class TextCache:
+    def __init__(self, root=CACHE_DIR, max_mb: float = CACHE_MAX_MB):
+        self.root = Path(root)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+
+    @cached_property
+    def dir(self) -> Path:
+        # só no primeiro uso: a versão vem do pdfplumber, que é caro de importar
+        return self.root / _version_tag()
+
+    def _path(self, sha1: str) -> Path:
+        return self.dir / sha1[:2] / f"{sha1}.json.gz"
+
+    def get(self, sha1: str) -> tuple[int, dict] | None:
+        """(n_páginas, {índice: texto}) ou None se não houver entrada válida."""
+        p = self._path(sha1)
+        try:
+            with gzip.open(p, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+            os.utime(p)                         # LRU: uso conta como acesso recente
+        except (OSError, ValueError, EOFError):
+            return None
+        return data["n_pages"], {int(i): t for i, t in data["pages"].items()}
+
+    def has(self, sha1: str) -> bool:
+        return self._path(sha1).exists()
+
+    def put(self, sha1: str, n_pages: int, texts: dict):
+        p = self._path(sha1)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_name(f"{p.name}.{os.getpid()}.tmp")
+        payload = {"n_pages": n_pages, "pages": {str(i): t for i, t in texts.items()}}
+        try:
+            with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=6) as f:
+                json.dump(payload, f, ensure_ascii=False)
+            os.replace(tmp, p)
+        except OSError:
+            tmp.unlink(missing_ok=True)
+
+    def prune(self) -> int:
+        """Remove as entradas mais antigas (de qualquer versão) até caber no limite.
+        Devolve quantas foram removidas."""
+        if not self.root.is_dir():
+            return 0
+        entries, total = [], 0
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                fp = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(fp)
+                except FileNotFoundError:
+                    continue
+                # versões antigas do pdfplumber nunca mais são lidas: saem antes
+                stale = not fp.startswith(str(self.dir) + os.sep)
+                entries.append((not stale, st.st_mtime, st.st_size, fp))
+                total += st.st_size
+        removed = 0
+        for _, _, size, fp in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(fp)
+            except FileNotFoundError:
+                pass
+            total -= size; removed += 1
+        return removed
+
+def default_cache() -> TextCache | None:
+    return TextCache() if CACHE_DIR else None
@@ -0,0 +1,32 @@
+import sys, types, threading
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "scripts"))
+sys.path.insert(0, str(ROOT / "tests"))
+
+from fake_drive import FakeDrive
+
+@pytest.fixture
+def drive(tmp_path, monkeypatch):
+    """drive_pull apontado para um FakeDrive local, rodando em tmp_path."""
+    import drive_pull
+    import googleapiclient.http
+    import googleapiclient.discovery
+    from google.auth.credentials import AnonymousCredentials
+
+    fake = FakeDrive()
+    url = fake.start()
+    build = googleapiclient.discovery.build
+    monkeypatch.setattr(googleapiclient.discovery, "build",
+                        lambda *a, **kw: build(*a, client_options={"api_endpoint": url + "/"}, **kw))
+    # backoff dos retries da biblioteca sem espera
+    monkeypatch.setattr(googleapiclient.http, "random", types.SimpleNamespace(random=lambda: 0.0))
+    monkeypatch.setattr(drive_pull, "get_credentials", AnonymousCredentials)
+    monkeypatch.setattr(drive_pull, "_local", threading.local())
+    monkeypatch.setattr(drive_pull, "FOLDER_ID", None)
+    monkeypatch.chdir(tmp_path)
+    yield fake
+    fake.stop()
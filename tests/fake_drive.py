@@ -0,0 +1,113 @@
+"""Drive v3 falso, servido por HTTP local, para os testes do drive_pull.
+
+Cobre o que o drive_pull usa: files.list paginado, get_media com Range (206/416) e
+export_media. Falhas são roteirizadas por arquivo: `fail[id] = [429, None, 503]`
+faz a 1ª requisição de mídia desse id devolver 429, a 2ª servir normalmente, a 3ª
+503, e as seguintes servirem normalmente.
+"""
+import re, json, time, hashlib, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+class FakeDrive:
+    def __init__(self, delay: float = 0.0):
+        self.files = {}             # id -> {name, mimeType, data, md5, modifiedTime}
+        self.fail = {}              # id -> [status | None, ...] (roteiro das requisições de mídia)
+        self.fail_list = []         # idem, para as páginas da listagem
+        self.delay = delay          # segundos por requisição de mídia
+        self.media = []             # (id, início do Range ou None) de cada requisição de mídia
+        self.active = self.max_active = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def add(self, file_id: str, name: str, data: bytes, mime: str = "application/pdf", md5: str | None = None):
+        n = len(self.files)
+        self.files[file_id] = {"name": name, "mimeType": mime, "data": data,
+                               "md5": md5 or hashlib.md5(data).hexdigest(),
+                               "modifiedTime": f"2025-01-01T00:{n // 60:02d}:{n % 60:02d}.000Z"}
+
+    def meta(self, file_id: str) -> dict:
+        f = self.files[file_id]
+        meta = {"id": file_id, "name": f["name"], "mimeType": f["mimeType"], "parents": ["FOLDER"],
+                "modifiedTime": f["modifiedTime"], "trashed": False}
+        if not f["mimeType"].startswith("application/vnd.google-apps"):
+            meta["md5Checksum"] = f["md5"]
+        return meta
+
+    def ranges(self, file_id: str) -> list:
+        return [start for fid, start in self.media if fid == file_id]
+
+    def start(self) -> str:
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(self))
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+def _handler(drive: FakeDrive):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, body: bytes, headers=None):
+            self.send_response(status)
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _json(self, obj, status: int = 200):
+            self._send(status, json.dumps(obj).encode(), {"Content-Type": "application/json"})
+
+        def _error(self, status: int):
+            self._json({"error": {"code": status, "message": "falha injetada"}}, status)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            qs = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if url.path.endswith("/files"):
+                if drive.fail_list and (status := drive.fail_list.pop(0)):
+                    return self._error(status)
+                ids = sorted(drive.files, key=lambda i: drive.files[i]["modifiedTime"], reverse=True)
+                start, size = int(qs.get("pageToken") or 0), int(qs.get("pageSize", 100))
+                page = {"files": [drive.meta(i) for i in ids[start:start + size]]}
+                if start + size < len(ids):
+                    page["nextPageToken"] = str(start + size)
+                return self._json(page)
+            m = re.search(r"/files/([^/]+)(/export)?$", url.path)
+            if m and m.group(1) in drive.files and (qs.get("alt") == "media" or m.group(2)):
+                return self._media(m.group(1))
+            self._error(404)
+
+        def _media(self, file_id: str):
+            rng = self.headers.get("Range")
+            start = int(rng.split("=")[1].split("-")[0]) if rng else None
+            with drive._lock:
+                drive.media.append((file_id, start))
+                script = drive.fail.get(file_id)
+                status = script.pop(0) if script else None
+                drive.active += 1
+                drive.max_active = max(drive.max_active, drive.active)
+            try:
+                if drive.delay:
+                    time.sleep(drive.delay)
+                if status:
+                    return self._error(status)
+                data = drive.files[file_id]["data"]
+                if start is None:
+                    return self._send(200, data)
+                if start >= len(data):
+                    return self._send(416, b"", {"Content-Range": f"bytes */{len(data)}"})
+                end = rng.split("=")[1].split("-")[1]
+                end = min(int(end) if end else len(data) - 1, len(data) - 1)
+                self._send(206, data[start:end + 1], {"Content-Range": f"bytes {start}-{end}/{len(data)}"})
+            finally:
+                with drive._lock:
+                    drive.active -= 1
+
+    return Handler
@@ -0,0 +1,94 @@
+import os
+
+import pytest
+
+import drive_pull
+
+def _add_pdfs(drive, n, size=20_000):
+    data = {f"id{i}": os.urandom(size) for i in range(n)}
+    for i, (fid, blob) in enumerate(data.items()):
+        drive.add(fid, f"GRU_SSA_{i:04d}.pdf", blob)
+    return data
+
+def _inbox():
+    return {p.name: p.read_bytes() for p in drive_pull.OUT_DIR.glob("*.pdf")}
+
+def test_429_is_retried(drive, monkeypatch):
+    monkeypatch.setattr(drive_pull, "WORKERS", 3)
+    data = _add_pdfs(drive, 6)
+    drive.fail = {"id0": [429, 429], "id1": [429], "id4": [503]}
+    drive.fail_list = [429]
+
+    state = drive_pull.run(folder_id="FOLDER")
+
+    assert _inbox() == {f"GRU_SSA_{i:04d}.pdf": data[f"id{i}"] for i in range(6)}
+    assert set(state["files"]) == set(data)
+    assert len(drive.media) == 6 + 4                # uma requisição extra por falha injetada
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_workers_bound_concurrent_downloads(drive, monkeypatch, workers):
+    monkeypatch.setattr(drive_pull, "WORKERS", workers)
+    drive.delay = 0.1
+    _add_pdfs(drive, 8)
+
+    drive_pull.run(folder_id="FOLDER")
+
+    assert len(_inbox()) == 8
+    if workers == 1:
+        assert drive.max_active == 1
+    else:
+        assert 2 <= drive.max_active <= workers
+
+def test_max_files_caps_downloads(drive, monkeypatch):
+    monkeypatch.setattr(drive_pull, "WORKERS", 4)
+    monkeypatch.setattr(drive_pull, "MAX_FILES", 3)
+    _add_pdfs(drive, 10)
+
+    state = drive_pull.run(folder_id="FOLDER")
+
+    assert len(_inbox()) == 3
+    assert len(state["files"]) == 3
+    assert len({fid for fid, _ in drive.media}) == 3    # nenhum download além do limite
+
+def test_resume_continues_from_last_byte(drive, monkeypatch):
+    monkeypatch.setattr(drive_pull, "CHUNK_SIZE", 8_000)
+    monkeypatch.setattr(drive_pull, "NUM_RETRIES", 0)
+    data = _add_pdfs(drive, 1, size=30_000)
+    drive.fail = {"id0": [None, 503]}               # 1º pedaço vem, o 2º falha
+
+    drive_pull.run(folder_id="FOLDER")
+
+    assert _inbox() == {"GRU_SSA_0000.pdf": data["id0"]}
+    assert drive.ranges("id0") == [0, 8_000, 8_000, 16_000, 24_000]
+
+def test_resume_from_previous_run_part(drive, monkeypatch):
+    data = _add_pdfs(drive, 1, size=30_000)
+    md5 = drive.files["id0"]["md5"]
+    drive_pull.PARTIAL_DIR.mkdir(parents=True)
+    (drive_pull.PARTIAL_DIR / f"id0-{md5}.part").write_bytes(data["id0"][:12_345])
+
+    drive_pull.run(folder_id="FOLDER")
+
+    assert _inbox() == {"GRU_SSA_0000.pdf": data["id0"]}
+    assert drive.ranges("id0") == [12_345]
+    assert not list(drive_pull.PARTIAL_DIR.glob("*.part"))
+
+def test_complete_part_is_delivered_on_416(drive):
+    data = _add_pdfs(drive, 1)
+    md5 = drive.files["id0"]["md5"]
+    drive_pull.PARTIAL_DIR.mkdir(parents=True)
+    (drive_pull.PARTIAL_DIR / f"id0-{md5}.part").write_bytes(data["id0"])
+
+    drive_pull.run(folder_id="FOLDER")
+
+    assert _inbox() == {"GRU_SSA_0000.pdf": data["id0"]}
+    assert drive.ranges("id0") == [len(data["id0"])]
+
+def test_md5_mismatch_fails_without_leftovers(drive):
+    drive.add("id0", "GRU_SSA_0000.pdf", os.urandom(20_000), md5="0" * 32)
+
+    state = drive_pull.run(folder_id="FOLDER")
+
+    assert _inbox() == {}
+    assert "id0" not in state["files"]
+    assert not list(drive_pull.PARTIAL_DIR.glob("*.part"))
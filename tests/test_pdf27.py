@@ -0,0 +1,46 @@
+import pytest
+
+import pdf27
+
+@pytest.mark.parametrize("line, entity", [
+    ("MyTrip.com R$ 1.234,56", "mytrip"),          # o trip.com dentro de mytrip.com não conta
+    ("Trip.com R$ 1.234,56", "trip.com"),
+    ("Oferta Primetour", "primetour"),              # nem o tap de "ofertaprimetour"
+    ("Deco lar R$ 980,00", "decolar"),              # nome quebrado pelo pdfplumber
+    ("Kiwi.com", "kiwi.com"),
+    ("Golden Tulip R$ 300,00", None),
+    ("R$ 1.234,56", None),
+])
+def test_match_entity(line, entity):
+    assert pdf27.match_entity(line) == entity
+
+def test_export_workbook_splits_above_excel_limit(tmp_path, monkeypatch):
+    import pandas as pd
+    from openpyxl import load_workbook
+
+    monkeypatch.setattr(pdf27, "XLSX_MAX_ROWS", 4)                 # cabeçalho + 3 linhas por aba
+    monkeypatch.setattr(pdf27, "MASTER_LAYOUT", "file")
+    monkeypatch.setattr(pdf27, "MASTER_OUT", str(tmp_path / "OFERTAS.parquet"))
+    monkeypatch.setattr(pdf27, "ERRORS_OUT", str(tmp_path / "ERROS.parquet"))
+    pdf27._write_parquet(pd.DataFrame({"Nome do Arquivo": [f"A{i}.PDF" for i in range(7)], "Preço": [100.0] * 7}),
+                         pdf27.MASTER_OUT)
+
+    n_of, n_er = pdf27.export_workbook(str(tmp_path / "M.xlsx"))
+
+    wb = load_workbook(tmp_path / "M.xlsx", read_only=True)
+    assert (n_of, n_er) == (7, 0)
+    assert wb.sheetnames == ["OFERTAS", "OFERTAS_2", "OFERTAS_3", "ERRO_MONITORAMENTO"]
+    assert [sum(1 for _ in wb[s].iter_rows()) for s in wb.sheetnames[:3]] == [4, 4, 2]
+
+def test_master_keeps_price_cents(tmp_path):
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path = str(tmp_path / "OFERTAS.parquet")
+    prices = [453.98, 131072.01, 9999999.99]                    # float32 erraria os dois últimos
+    pdf27._write_parquet(pd.DataFrame({"Nome do Arquivo": ["A.PDF"] * 3, "Preço": prices}), path)
+
+    assert pq.read_schema(path).field("Preço").type == pa.decimal128(12, 2)
+    assert [str(v) for v in pq.read_table(path).column("Preço").to_pylist()] == ["453.98", "131072.01", "9999999.99"]
+    assert pdf27._table_to_df(pq.read_table(path))["Preço"].tolist() == prices